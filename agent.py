@@ -1,10 +1,42 @@
-import copy, util
+import util, disease
 from culture import BasicCulture
+from agent_pool import Column, GenderColumn
+from grid import TileGrid
+
+class Agent(object):
+    # Scalar properties are stored in the world's AgentPool (see
+    # agent_pool.py), everything else lives in the slots below.
+    __slots__ = [
+        "world", "rand", "pool", "id", "dead", "death_cause",
+        "children", "mates", "culture_tags", "culture_type", "culture",
+        "immune_sys", "initial_immune_sys", "immunities", "diseases", "disease_ids",
+    ]
+
+    x                 = Column("x")
+    y                 = Column("y")
+    age               = Column("age")
+    max_age           = Column("max_age")
+    vision            = Column("vision")
+    gender            = GenderColumn("gender")
+    fertile_age_start = Column("fertile_age_start")
+    fertile_age_end   = Column("fertile_age_end")
+    sugar_metabolism  = Column("sugar_metabolism")
+    spice_metabolism  = Column("spice_metabolism")
+    sugar             = Column("sugar")
+    spice             = Column("spice")
+    initial_sugar     = Column("initial_sugar")
+    initial_spice     = Column("initial_spice")
+    disease_sugar_metabolism = Column("disease_sugar_metabolism")
+    disease_spice_metabolism = Column("disease_spice_metabolism")
+    num_diseases      = Column("num_diseases")
+    culture_length    = Column("culture_length")
+    culture_ones      = Column("culture_ones")
 
-class Agent():
     def __init__(self, world, **kwargs):
         self.world = world
         self.rand = world.rand
+        self.pool = world.agent_pool
+        self.id = self.pool.allocate(self)
         self.dead = False
         self.age = 0
         self.death_cause = "none"
@@ -26,13 +58,23 @@ class Agent():
         self.initial_spice      = kwargs.get("spice", 1)
         self.spice              = kwargs.get("spice", 1)
 
-        self.culture_tags       = kwargs.get("culture_tags", [0])
+        # culture tags are packed into an int like immune systems, with the
+        # number of 1 tags kept in culture_ones
+        self.culture_tags       = kwargs.get("culture_tags", 0)
+        self.culture_length     = kwargs.get("num_culture_tags", 1)
+        self.culture_ones       = util.popcount(self.culture_tags)
         self.culture_type       = kwargs.get("culture", "BasicCulture")
 
-        self.immune_sys         = kwargs.get("immune_sys", [])
-        self.initial_immune_sys = copy.deepcopy(self.immune_sys)
+        # immune systems are bit strings packed into ints, see disease.py
+        self.immune_sys         = kwargs.get("immune_sys", 0)
+        self.initial_immune_sys = self.immune_sys
+        self.immunities         = disease.getImmunities(self.immune_sys, self.world.immune_sys_length,
+            self.world.diseases, self.world.legacy_immune_matching)
 
+        # diseases holds an Infection for each current disease, disease_ids is
+        # a bitmask of their disease ids.
         self.diseases = []
+        self.disease_ids = 0
         for d in kwargs.get("diseases", []):
             self.infect(d)
 
@@ -45,34 +87,51 @@ class Agent():
 
 
     def tick(self):
+        if self.metabolise():
+            self.act()
+
+
+    def metabolise(self):
+        # Returns False if the agent died of old age or starvation.
         if self.age >= self.max_age:
             self.dead = True
             self.death_cause = "age"
             self.distributeWealth()
-            return
+            return False
+
+        x, y = self.x, self.y
+        sugar, spice = self.sugar, self.spice
 
         sugar_m = self.getTotalSugarMetabolism()
-        sugar_consumed = min(self.sugar, sugar_m)
-        self.sugar -= sugar_m
-        self.world.addSugarMetabolismPollution(self.x, self.y, sugar_consumed)
+        sugar_consumed = min(sugar, sugar_m)
+        sugar -= sugar_m
+        self.sugar = sugar
+        self.world.addSugarMetabolismPollution(x, y, sugar_consumed)
 
-        if self.sugar < 0.0:
+        if sugar < 0.0:
             self.dead = True
             self.death_cause = "sugar starvation"
-            return
+            return False
 
         spice_m = self.getTotalSpiceMetabolism()
-        spice_consumed = min(self.spice, spice_m)
-        self.spice -= spice_m
-        self.world.addSpiceMetabolismPollution(self.x, self.y, spice_consumed)
+        spice_consumed = min(spice, spice_m)
+        spice -= spice_m
+        self.spice = spice
+        self.world.addSpiceMetabolismPollution(x, y, spice_consumed)
 
-        if self.spice < 0.0:
+        if spice < 0.0:
             self.dead = True
             self.death_cause = "spice starvation"
-            return
+            return False
 
+        return True
+
+
+    def act(self, location=None):
+        # location is the tile to move to. If it is None the agent looks for
+        # the best tile itself.
         self.age += 1
-        self.move()
+        self.move(location)
         self.culture.update()
         self.immuneResponse()
         self.infectNeighbours()
@@ -86,41 +145,75 @@ class Agent():
         sugar = self.sugar / len(self.children)
         spice = self.spice / len(self.children)
         for c in self.children:
-            c.sugar += sugar
-            c.spice += spice
+            # dead children have been removed from the agent pool
+            if not c.dead:
+                c.sugar += sugar
+                c.spice += spice
 
 
     def getTotalSugarMetabolism(self):
-        m = 0
-        for d in self.diseases:
-            m += d.extra_sugar
-        return self.sugar_metabolism + m
+        return self.sugar_metabolism + self.disease_sugar_metabolism
 
 
     def getTotalSpiceMetabolism(self):
-        m = 0
-        for d in self.diseases:
-            m += d.extra_spice
-        return self.spice_metabolism + m
+        return self.spice_metabolism + self.disease_spice_metabolism
+
+
+    def move(self, location=None):
+        if location is None:
+            location = self.findBestLocation()
+
+        # move to the best location found (this could be the same location the
+        # agent is currently in)
+        world = self.world
+        x, y = world.updateAgentPosition(self, self.x, self.y, location[0], location[1])
+        self.x, self.y = x, y
+
+        # harvest
+        self.sugar += world.harvestSugarAt(x, y)
+        self.spice += world.harvestSpiceAt(x, y)
+
 
+    def findBestLocation(self):
+        # The agent's position, vision, reserves and metabolisms don't change
+        # while it looks around, so they are read from the pool once.
+        x1, y1 = self.x, self.y
+        vision = self.vision
 
-    def move(self):
         # create a list of tiles to check out, one list for each axis of vision.
         # tiles ordered from nearst to furthers.
         dirs = []
-        dirs.append([(self.x, self.y+y+1) for y in range(self.vision)])
-        dirs.append([(self.x, self.y-y-1) for y in range(self.vision)])
-        dirs.append([(self.x+x+1, self.y) for x in range(self.vision)])
-        dirs.append([(self.x-x-1, self.y) for x in range(self.vision)])
+        dirs.append([(x1, y1+y+1) for y in range(vision)])
+        dirs.append([(x1, y1-y-1) for y in range(vision)])
+        dirs.append([(x1+x+1, y1) for x in range(vision)])
+        dirs.append([(x1-x-1, y1) for x in range(vision)])
 
         # shuffle so the order each direction to be checked is random
         self.rand.shuffle(dirs)
 
+        # welfare formula form p.97, see rateTile
+        sugar, spice = self.sugar, self.spice
+        m1, m2 = self.getTotalSugarMetabolism(), self.getTotalSpiceMetabolism()
+        mt = m1 + m2
+        e1, e2 = m1/mt, m2/mt
+
+        # The tiles are read straight from the grid with wrapped coordinates
+        # (see World.getSugarAt etc.), so each tile is only wrapped once.
+        world = self.world
+        tx, ty = world.getWorldSize()
+        g = world.grid
+        agent_at, pollution_at = g.agent.item, g.pollution.item
+        sugar_at, spice_at = g.sugar.item, g.spice.item
+        regrow = world.regrowTile if world.lazy_regrowth else None
+
         # Set the best move to the current agent location as an agent shouldn't
         # move if its  current location is the best one.
-        x1, y1 = self.x, self.y
         best_location = (x1, y1)
-        best_location_value = self.rateTile(x1, y1)
+        x, y = x1 % tx, y1 % ty
+        if regrow:
+            regrow(x, y)
+        W = ((sugar + sugar_at(x, y)) ** e1) * ((spice + spice_at(x, y)) ** e2)
+        best_location_value = W / (1.0+pollution_at(x, y))
         distance = 0
 
         # Check for the best tile to move to.
@@ -129,12 +222,16 @@ class Agent():
         # best one found so far.
         for dir_array in dirs:
             for d in dir_array:
-                x2, y2 = d[0], d[1]
+                x2, y2 = d
+                x, y = x2 % tx, y2 % ty
 
-                if self.world.isTileOccupied(x2, y2):
+                if agent_at(x, y) != TileGrid.NONE:
                     continue
 
-                value = self.rateTile(x2, y2)
+                if regrow:
+                    regrow(x, y)
+                W = ((sugar + sugar_at(x, y)) ** e1) * ((spice + spice_at(x, y)) ** e2)
+                value = W / (1.0+pollution_at(x, y))
                 dist = (x2-x1 * x2-x1) + (y2-y1 * x2-y1)
 
                 if value > best_location_value or (value == best_location_value and dist < distance):
@@ -142,14 +239,7 @@ class Agent():
                     best_location = d
                     distance = dist
 
-
-        # move to the best location found (this could be the same location the
-        # agent is currently in)
-        self.x, self.y = self.world.updateAgentPosition(self, self.x, self.y, best_location[0], best_location[1])
-
-        # harvest
-        self.sugar += self.world.harvestSugarAt(self.x, self.y)
-        self.spice += self.world.harvestSpiceAt(self.x, self.y)
+        return best_location
 
 
     def rateTile(self, x, y):
@@ -252,26 +342,28 @@ class Agent():
             father.spice -= father.initial_spice / 2.0
 
             # create the child's initial cultural tags
-            num_tags = len(self.culture_tags) #TODO account for different length tags?
-            child_tags = []
-            for i in range(0, num_tags):
-                if mother.culture_tags[i] == father.culture_tags[i]:
-                    child_tags.append(mother.culture_tags[i])
-                else:
-                    child_tags.append(self.rand.choice((0, 1)))
+            num_tags = self.culture_length #TODO account for different length tags?
+            CM = mother.culture_tags
+            CF = father.culture_tags
+            child_tags = CM & CF
+            differ = CM ^ CF
+            for i in range(num_tags):
+                if (differ >> i) & 1 and self.rand.choice((0, 1)):
+                    child_tags |= 1 << i
 
             args["culture_type"] = self.rand.choice((mother.culture_type, father.culture_type))
             args["culture_tags"] = child_tags
+            args["num_culture_tags"] = num_tags
 
-            # create the child's immune system
-            I = []
+            # create the child's immune system. Bits the parents share are
+            # inherited, the rest are chosen at random.
             IM = mother.initial_immune_sys
             IF = father.initial_immune_sys
-            for i in range(len(IM)):
-                if IM[i] == IF[i]:
-                    I.append(IM[i])
-                else:
-                    I.append(self.rand.choice((0, 1)))
+            I = IM & IF
+            differ = IM ^ IF
+            for i in range(self.world.immune_sys_length):
+                if (differ >> i) & 1 and self.rand.choice((0, 1)):
+                    I |= 1 << i
 
             args["immune_sys"] = I
 
@@ -279,10 +371,7 @@ class Agent():
             child = self.world.spawnAgent(args)
 
             # update family connections
-            mother.children.append(child)
-            father.children.append(child)
-            mother.mates.append(father)
-            father.mates.append(mother)
+            self.world.agentsMated(mother, father, child)
 
 
     def isFertile(self):
@@ -308,70 +397,50 @@ class Agent():
         if not self.diseases:
             return
 
-        d = self.diseases[0]
+        infection = self.diseases[0]
+        d = infection.disease
 
         # if the disease has not had an immune response yet, position will be None.
         # we must find the substring in immume_sys that has the closest hamming
         # distance to the diseases's string
-        if d.position is None:
-            I = self.immune_sys
-            D = d.string
-            min_dist, position = len(D), 0
-
-            for i in range(len(I) - len(D)):
-                dist = 0
-                for bit2 in D:
-                    if I[i] != bit2:
-                        dist += 1
-
-                if dist < min_dist:
-                    min_dist = dist
-                    position = i
-            d.position = position
-
-
-        # fight the disease
-        I = self.immune_sys
-        D = d.string
-        p = d.position
-        for i in range(len(D)):
-            if I[p+i] != D[i]:
-                I[p+i] = D[i]
-                break;
+        if infection.position is None:
+            infection.position = disease.findClosestMatch(self.immune_sys, self.world.immune_sys_length,
+                d.string, d.length, self.world.legacy_immune_matching)
+
+
+        # fight the disease by flipping the first bit that differs
+        p = infection.position
+        differ = disease.getWindow(self.immune_sys, p, d.length) ^ d.string
+        if differ:
+            flip = (differ & -differ) << p
+            old_immune_sys = self.immune_sys
+            self.immune_sys ^= flip
+            self.immunities = disease.updateImmunities(self.immunities, old_immune_sys, self.immune_sys,
+                flip.bit_length() - 1, self.world.immune_sys_length, self.world.diseases,
+                self.world.legacy_immune_matching)
 
         # check if flipping the bit cured the disease
-        d.cured = True
-        for i in range(len(D)):
-            if I[p+i] != D[i]:
-                d.cured = False
-                break;
-
-        self.diseases = [d for d in self.diseases if not d.cured]
+        if disease.getWindow(self.immune_sys, p, d.length) == d.string:
+            del self.diseases[0]
+            self.num_diseases -= 1
+            self.disease_ids &= ~(1 << d.id)
+            self.disease_sugar_metabolism -= d.extra_sugar
+            self.disease_spice_metabolism -= d.extra_spice
 
 
     def infect(self, d):
-        for d2 in self.diseases:
-            if d.string == d2.string:
-                return
-
-        # check if the agent is currently immune
-        I = self.immune_sys
-        D = d.string
-
-        for i in range(len(I) - len(D)):
-            dist = 0
-            for bit2 in D:
-                if I[i] != bit2:
-                    dist += 1
-
-            if dist == 0:
-                return;
+        # d is a Disease shared between all agents
+        bit = 1 << d.id
+        if (self.disease_ids | self.immunities) & bit:
+            # the agent already has the disease or is currently immune
+            return
 
-        # FIXME don't really need to copy but simplifies implementaion
-        disease = copy.deepcopy(d)
-        disease.position = None
-        disease.cured = False
-        self.diseases.append(disease)
+        self.diseases.append(disease.Infection(d))
+        self.disease_ids |= bit
+        pool, i = self.pool, self.id
+        pool.num_diseases[i] += 1
+        pool.disease_sugar_metabolism[i] += d.extra_sugar
+        pool.disease_spice_metabolism[i] += d.extra_spice
 
 
     def infectNeighbours(self):
@@ -380,5 +449,5 @@ class Agent():
 
         ns = self.world.getNeighbourAgents(self.x, self.y)
         for n in ns:
-            n.infect(self.rand.choice(self.diseases))
+            n.infect(self.rand.choice(self.diseases).disease)
 
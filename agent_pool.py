@@ -0,0 +1,159 @@
+#
+# Columnar storage for agent data.
+#
+# The scalar properties of every agent (position, age, sugar, ...) are kept
+# in one numpy array per property, indexed by agent id. Agent objects are
+# small views holding their id, so agent code can keep using a.sugar etc.
+# while whole population passes (statistics, drawing, batched movement) can
+# work on the columns directly.
+#
+# Ids of dead agents are put on a free list and reused for new agents.
+#
+
+import numpy
+
+
+class AgentPool():
+    # (name, dtype) of each column
+    COLUMNS = [
+        ("x",                 numpy.int64),
+        ("y",                 numpy.int64),
+        ("age",               numpy.int64),
+        ("max_age",           numpy.int64),
+        ("vision",            numpy.int64),
+        ("gender",            numpy.int8),
+        ("fertile_age_start", numpy.int64),
+        ("fertile_age_end",   numpy.int64),
+        ("sugar_metabolism",  numpy.float64),
+        ("spice_metabolism",  numpy.float64),
+        ("sugar",             numpy.float64),
+        ("spice",             numpy.float64),
+        ("initial_sugar",     numpy.float64),
+        ("initial_spice",     numpy.float64),
+        # extra metabolism from the agent's current diseases
+        ("disease_sugar_metabolism", numpy.float64),
+        ("disease_spice_metabolism", numpy.float64),
+        # number of diseases the agent has
+        ("num_diseases",      numpy.int64),
+        # number of culture tags and how many of them are 1
+        ("culture_length",    numpy.int64),
+        ("culture_ones",      numpy.int64),
+    ]
+
+    # genders are stored as indices into GENDERS
+    GENDERS = ["male", "female"]
+
+    def __init__(self, capacity=1024):
+        self.capacity = 0
+        # ids below size have been handed out at some point
+        self.size = 0
+        self.free = []
+
+        # the column arrays by name, kept alongside the attributes so Column
+        # can find them without a getattr on every access
+        self.columns = {}
+        for name, dtype in AgentPool.COLUMNS:
+            self.setColumn(name, numpy.zeros(0, dtype))
+        self.alive = numpy.zeros(0, bool)
+        # the Agent view of each living agent, indexed by id
+        self.views = []
+
+        self.grow(capacity)
+
+
+    def grow(self, capacity):
+        if capacity <= self.capacity:
+            return
+
+        for name, dtype in AgentPool.COLUMNS:
+            column = numpy.zeros(capacity, dtype)
+            column[:self.capacity] = self.columns[name]
+            self.setColumn(name, column)
+
+        alive = numpy.zeros(capacity, bool)
+        alive[:self.capacity] = self.alive
+        self.alive = alive
+
+        self.views.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+
+    def setColumn(self, name, column):
+        setattr(self, name, column)
+        self.columns[name] = column
+
+
+    def allocate(self, view):
+        # Returns a free id and registers view as the agent using it.
+        if self.free:
+            i = self.free.pop()
+        else:
+            if self.size >= self.capacity:
+                self.grow(self.capacity * 2)
+            i = self.size
+            self.size += 1
+
+        for column in self.columns.itervalues():
+            column[i] = 0
+        self.alive[i] = True
+        self.views[i] = view
+        return i
+
+
+    def release(self, view):
+        # The id may be handed out again straight away, so the released view
+        # is detached from the pool and its columns can no longer be used.
+        i = view.id
+        self.alive[i] = False
+        self.views[i] = None
+        self.free.append(i)
+        view.pool = None
+
+
+    def getAgent(self, i):
+        return self.views[i]
+
+
+    def countFertile(self):
+        # vectorised Agent.isFertile over all living agents
+        n = self.size
+        age = self.age[:n]
+        fertile = (self.alive[:n]
+            & (self.fertile_age_start[:n] <= age) & (age <= self.fertile_age_end[:n])
+            & (self.sugar[:n] >= self.initial_sugar[:n])
+            & (self.spice[:n] >= self.initial_spice[:n]))
+        return int(numpy.count_nonzero(fertile))
+
+
+    def getLiveIds(self):
+        return numpy.flatnonzero(self.alive[:self.size])
+
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+
+
+class Column(object):
+    # Descriptor for an Agent property stored in the agent's AgentPool.
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, agent, owner):
+        if agent is None:
+            return self
+        return agent.pool.columns[self.name].item(agent.id)
+
+    def __set__(self, agent, v):
+        agent.pool.columns[self.name][agent.id] = v
+
+
+
+class GenderColumn(Column):
+    def __get__(self, agent, owner):
+        if agent is None:
+            return self
+        return AgentPool.GENDERS[agent.pool.gender.item(agent.id)]
+
+    def __set__(self, agent, v):
+        agent.pool.gender[agent.id] = AgentPool.GENDERS.index(v)
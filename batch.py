@@ -0,0 +1,15 @@
+import argparse
+from headless import Headless
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the sugarscape simulation without a display.")
+    parser.add_argument("config", help="simulation config file, e.g. sugarscape.yaml")
+    parser.add_argument("ticks", type=int, help="number of ticks to run")
+    parser.add_argument("output_dir", help="directory the run's statistics are written to")
+    parser.add_argument("--history", action="store_true", help="also write each statistic's full time series as a raw binary file")
+    parser.add_argument("--checkpoint", default=None, help="file to write checkpoints to, and to carry on from if it exists")
+    parser.add_argument("--checkpoint-ticks", type=int, default=1000, help="number of ticks between checkpoints (default: 1000)")
+    args = parser.parse_args()
+
+    h = Headless()
+    h.run(args.config, args.ticks, args.output_dir, args.history, args.checkpoint, args.checkpoint_ticks)
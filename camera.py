@@ -1,4 +1,27 @@
 class Camera():
+    # x, y is the world position at the bottom left of the view and width,
+    # height the size of the view in screen pixels. zoom is the number of
+    # screen pixels per world unit.
     def __init__(self, x, y, w, h):
         self.x, self.y, self.width, self.height = x, y, w, h
+        self.zoom = 1.0
 
+
+    def pan(self, dx, dy):
+        # moves the view by dx, dy screen pixels
+        self.x += dx / self.zoom
+        self.y += dy / self.zoom
+
+
+    def zoomBy(self, factor, sx, sy, min_zoom=1.0/256, max_zoom=16.0):
+        # Zooms in by factor, keeping the world position at screen position
+        # sx, sy (relative to the view) where it is.
+        wx, wy = self.x + sx / self.zoom, self.y + sy / self.zoom
+        self.zoom = min(max(self.zoom * factor, min_zoom), max_zoom)
+        self.x, self.y = wx - sx / self.zoom, wy - sy / self.zoom
+
+
+    def getVisibleRect(self):
+        # the world rectangle (x1, y1, x2, y2) in view
+        return (self.x, self.y,
+            self.x + self.width / self.zoom, self.y + self.height / self.zoom)
@@ -0,0 +1,381 @@
+#
+# Saving and restoring the full state of a simulation.
+#
+# A checkpoint holds everything that changes while the world runs: the tile
+# layers, the agents (including who their children and mates are), the
+# diseases, the regions' seasons, the statistics and the state of the random
+# number generator. A world restored from a checkpoint carries on exactly as
+# the saved one would have.
+#
+# Checkpoints are compressed numpy .npz files. Scalars, strings and the
+# config the world was created from are kept as JSON in the "header" array,
+# everything else as arrays. Arbitrarily long bit strings (immune systems,
+# culture tags, ...) are stored as fixed width rows of bytes.
+#
+# Building the arrays only takes copies of the world's state, which is
+# quick. CheckpointWriter does the slow part, compressing and writing them,
+# on a background thread.
+#
+# Nothing here may depend on PySFML or OpenGL.
+#
+
+import os, json, binascii, threading, Queue, numpy
+from agent import Agent
+from culture import BasicCulture
+from disease import Disease, Infection
+from grid import TileGrid
+
+
+# bumped whenever the layout of checkpoints changes
+FORMAT_VERSION = 2
+
+# TileGrid arrays saved as they are
+GRID_ARRAYS = ["sugar", "spice", "max_sugar", "max_spice", "pollution", "region",
+    "agent", "neighbours", "updated", "pollution_back", "pollution_marked"]
+
+# SeasonCalendar arrays saved as they are
+CALENDAR_ARRAYS = ["sugar_growth", "spice_growth", "change_tick", "change_sugar", "change_spice"]
+
+
+def packInts(values, nbits):
+    # non-negative ints of up to nbits bits as rows of bytes
+    nbytes = max(1, (nbits + 7) // 8)
+    if not values:
+        return numpy.zeros((0, nbytes), numpy.uint8)
+    hex_string = "".join("{0:0{1}x}".format(v, nbytes * 2) for v in values)
+    return numpy.frombuffer(binascii.unhexlify(hex_string), numpy.uint8).reshape(len(values), nbytes)
+
+
+def unpackInts(rows):
+    return [int(binascii.hexlify(row.tostring()), 16) for row in rows]
+
+
+def splitLists(counts, values):
+    # the inverse of concatenating lists of the given lengths
+    ends = numpy.cumsum(counts)
+    return [values[end-n:end] for n, end in zip(counts, ends)]
+
+
+
+def getState(world):
+    # Returns a dict of arrays holding the world's state, sharing no memory
+    # with the world.
+    state = {}
+    header = {
+        "format": FORMAT_VERSION,
+        "config": world.data_file,
+        "current_tick": world.current_tick,
+        "next_pollution_tick": world.next_pollution_tick,
+        "next_disease_infliction_tick": world.next_disease_infliction_tick,
+        "num_births": world.num_births,
+        "num_deaths": world.num_deaths,
+        "death_causes": world.death_causes,
+        "grown_ticks": world.grown_ticks,
+    }
+
+    # random number generator
+    version, internal, gauss_next = world.rand.getstate()
+    header["rand_version"] = version
+    header["rand_gauss_next"] = gauss_next
+    state["rand_state"] = numpy.array(internal, numpy.uint32)
+
+    # tiles
+    g = world.grid
+    for name in GRID_ARRAYS:
+        state["grid_" + name] = getattr(g, name).copy()
+    state["grid_pollution_active"] = g.pollution_active.copy()
+    state["grid_pollution_added"] = numpy.array(g.pollution_added, numpy.int64)
+    header["grid_pollution_back_clear"] = g.pollution_back_clear
+
+    # seasons and regrowth
+    c = world.calendar
+    for name in CALENDAR_ARRAYS:
+        state["calendar_" + name] = getattr(c, name).copy()
+    state["calendar_season_index"] = numpy.array(c.season_index, numpy.int64)
+    state["calendar_events"] = numpy.array(c.events, numpy.int64).reshape(-1, 2)
+    state["region_sugar_total"] = world.region_sugar_total.copy()
+    state["region_spice_total"] = world.region_spice_total.copy()
+
+    # diseases, in the world's order
+    ds = world.diseases
+    state["disease_id"] = numpy.array([d.id for d in ds], numpy.int64)
+    state["disease_length"] = numpy.array([d.length for d in ds], numpy.int64)
+    state["disease_extra_sugar"] = numpy.array([d.extra_sugar for d in ds], numpy.float64)
+    state["disease_extra_spice"] = numpy.array([d.extra_spice for d in ds], numpy.float64)
+    state["disease_string"] = packInts([d.string for d in ds], max([d.length for d in ds] + [0]))
+    num_disease_bits = max([d.id + 1 for d in ds] + [0])
+
+    # Agent objects are numbered with the living agents first, in the
+    # world's order, followed by dead agents still listed as someone's child
+    # or mate. Only the dead flag and death cause of dead agents are used.
+    agents = list(world.agents)
+    index = dict((id(a), i) for i, a in enumerate(agents))
+    def getIndex(a):
+        if id(a) not in index:
+            index[id(a)] = len(agents)
+            agents.append(a)
+        return index[id(a)]
+
+    living = world.agents
+    children = [getIndex(c) for a in living for c in a.children]
+    mates = [getIndex(m) for a in living for m in a.mates]
+    dead = agents[len(living):]
+
+    state["agent_id"] = numpy.array([a.id for a in living], numpy.int64)
+    state["agent_num_children"] = numpy.array([len(a.children) for a in living], numpy.int64)
+    state["agent_children"] = numpy.array(children, numpy.int64)
+    state["agent_num_mates"] = numpy.array([len(a.mates) for a in living], numpy.int64)
+    state["agent_mates"] = numpy.array(mates, numpy.int64)
+    header["agent_culture_type"] = [a.culture_type for a in living]
+    header["dead_agent_death_cause"] = [a.death_cause for a in dead]
+    state["dead_agent_id"] = numpy.array([a.id for a in dead], numpy.int64)
+
+    culture_bits = max([a.culture_length for a in living] + [0])
+    immune_bits = world.immune_sys_length
+    state["agent_culture_tags"] = packInts([a.culture_tags for a in living], culture_bits)
+    state["agent_immune_sys"] = packInts([a.immune_sys for a in living], immune_bits)
+    state["agent_initial_immune_sys"] = packInts([a.initial_immune_sys for a in living], immune_bits)
+    state["agent_immunities"] = packInts([a.immunities for a in living], num_disease_bits)
+    state["agent_disease_ids"] = packInts([a.disease_ids for a in living], num_disease_bits)
+
+    # infections, in each agent's order
+    infections = [inf for a in living for inf in a.diseases]
+    state["agent_num_infections"] = numpy.array([len(a.diseases) for a in living], numpy.int64)
+    # diseases with equal strings share an id, so infections refer to their
+    # disease by its index in the world's list
+    disease_index = dict((id(d), i) for i, d in enumerate(ds))
+    state["infection_disease"] = numpy.array([disease_index[id(inf.disease)] for inf in infections], numpy.int64)
+    state["infection_position"] = numpy.array(
+        [-1 if inf.position is None else inf.position for inf in infections], numpy.int64)
+
+    # the agent pool's columns
+    pool = world.agent_pool
+    n = pool.size
+    header["pool_capacity"] = pool.capacity
+    header["pool_size"] = n
+    state["pool_free"] = numpy.array(pool.free, numpy.int64)
+    state["pool_alive"] = pool.alive[:n].copy()
+    for name, dtype in pool.COLUMNS:
+        state["pool_" + name] = getattr(pool, name)[:n].copy()
+
+    # statistics
+    stats = world.stats
+    header["stats_current_tick"] = stats.current_tick
+    header["stats_totals"] = [stats.total_vision, stats.total_sugar_metabolism,
+        stats.total_mates, stats.total_children]
+    for i, d in enumerate(stats.getAllData()):
+        state["stats_buffer_{0}".format(i)] = d.buffer.copy()
+        header["stats_count_{0}".format(i)] = d.count
+
+    state["header"] = numpy.array(json.dumps(header))
+    return state
+
+
+def setState(world, state):
+    # Restores the state returned by getState into world, which must have
+    # been initialised from the same config (see load).
+    header = json.loads(str(state["header"]))
+    if header["format"] != FORMAT_VERSION:
+        raise ValueError("checkpoint format {0} can't be read, expected {1}".format(header["format"], FORMAT_VERSION))
+
+    world.current_tick = header["current_tick"]
+    world.next_pollution_tick = header["next_pollution_tick"]
+    world.next_disease_infliction_tick = header["next_disease_infliction_tick"]
+    world.num_births = header["num_births"]
+    world.num_deaths = header["num_deaths"]
+    world.death_causes = dict((str(k), v) for k, v in header["death_causes"].items())
+    world.grown_ticks = header["grown_ticks"]
+
+    gauss_next = header["rand_gauss_next"]
+    world.rand.setstate((header["rand_version"],
+        tuple(int(v) for v in state["rand_state"]), gauss_next))
+
+    # tiles, every layer has changed as far as the renderer knows
+    g = world.grid
+    for name in GRID_ARRAYS:
+        getattr(g, name)[...] = state["grid_" + name]
+    g.pollution_active = state["grid_pollution_active"].copy()
+    g.pollution_added = [int(i) for i in state["grid_pollution_added"]]
+    g.pollution_back_clear = header["grid_pollution_back_clear"]
+    for layer in TileGrid.DIRTY_LAYERS:
+        g.getDirty(layer).fill(True)
+    world.max_sugar_level = float(max(1.0, g.max_sugar.max()))
+    world.max_spice_level = float(max(1.0, g.max_spice.max()))
+
+    # seasons and regrowth
+    c = world.calendar
+    for name in CALENDAR_ARRAYS:
+        getattr(c, name)[...] = state["calendar_" + name]
+    c.season_index = [int(i) for i in state["calendar_season_index"]]
+    c.events = [(int(t), int(i)) for t, i in state["calendar_events"]]
+    for i, r in enumerate(world.region_list):
+        r.setSeason(c.season_index[i])
+    world.region_sugar_total[...] = state["region_sugar_total"]
+    world.region_spice_total[...] = state["region_spice_total"]
+
+    # diseases
+    world.diseases = []
+    strings = unpackInts(state["disease_string"])
+    for i in range(len(strings)):
+        d = Disease.__new__(Disease)
+        d.id = int(state["disease_id"][i])
+        d.length = int(state["disease_length"][i])
+        d.extra_sugar = state["disease_extra_sugar"].item(i)
+        d.extra_spice = state["disease_extra_spice"].item(i)
+        d.string = strings[i]
+        world.diseases.append(d)
+
+    # the agent pool
+    pool = world.agent_pool
+    n = header["pool_size"]
+    pool.grow(header["pool_capacity"])
+    for name, dtype in pool.COLUMNS:
+        getattr(pool, name)[:n] = state["pool_" + name]
+    pool.alive[:] = False
+    pool.alive[:n] = state["pool_alive"]
+    pool.views = [None] * pool.capacity
+    pool.size = n
+    pool.free = [int(i) for i in state["pool_free"]]
+
+    # agents
+    ids = state["agent_id"]
+    num_living = len(ids)
+    agents = []
+    for i in range(num_living):
+        a = Agent.__new__(Agent)
+        a.world = world
+        a.rand = world.rand
+        a.pool = pool
+        a.id = int(ids[i])
+        a.dead = False
+        a.death_cause = "none"
+        pool.views[a.id] = a
+        agents.append(a)
+    for i, cause in enumerate(header["dead_agent_death_cause"]):
+        a = Agent.__new__(Agent)
+        a.world = world
+        a.rand = world.rand
+        a.pool = None
+        a.id = int(state["dead_agent_id"][i])
+        a.dead = True
+        a.death_cause = str(cause)
+        a.children = []
+        a.mates = []
+        agents.append(a)
+
+    children = splitLists(state["agent_num_children"], state["agent_children"])
+    mates = splitLists(state["agent_num_mates"], state["agent_mates"])
+    infections = splitLists(state["agent_num_infections"],
+        zip(state["infection_disease"], state["infection_position"]))
+    culture_tags = unpackInts(state["agent_culture_tags"])
+    immune_sys = unpackInts(state["agent_immune_sys"])
+    initial_immune_sys = unpackInts(state["agent_initial_immune_sys"])
+    immunities = unpackInts(state["agent_immunities"])
+    disease_ids = unpackInts(state["agent_disease_ids"])
+    culture_types = header["agent_culture_type"]
+
+    for i, a in enumerate(agents[:num_living]):
+        a.children = [agents[j] for j in children[i]]
+        a.mates = [agents[j] for j in mates[i]]
+        a.culture_tags = culture_tags[i]
+        a.culture_type = str(culture_types[i])
+        a.immune_sys = immune_sys[i]
+        a.initial_immune_sys = initial_immune_sys[i]
+        a.immunities = immunities[i]
+        a.disease_ids = disease_ids[i]
+        a.diseases = []
+        for d, position in infections[i]:
+            inf = Infection(world.diseases[int(d)])
+            if position >= 0:
+                inf.position = int(position)
+            a.diseases.append(inf)
+        if a.culture_type == "BasicCulture":
+            a.culture = BasicCulture(a, world, world.rand)
+
+    world.agents = agents[:num_living]
+
+    # statistics
+    stats = world.stats
+    stats.current_tick = header["stats_current_tick"]
+    stats.total_vision, stats.total_sugar_metabolism, stats.total_mates, stats.total_children = header["stats_totals"]
+    for i, d in enumerate(stats.getAllData()):
+        d.buffer[...] = state["stats_buffer_{0}".format(i)]
+        d.count = header["stats_count_{0}".format(i)]
+        d.head = d.count % d.size
+        d.spilled = d.count
+    if stats.shared_tick is not None:
+        stats.shared_tick.value = stats.current_tick
+
+
+def writeState(state, path):
+    # written under a temporary name first so a checkpoint being written
+    # never replaces a good one with a broken one
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        numpy.savez_compressed(f, **state)
+    os.rename(tmp_path, path)
+
+
+def readState(path):
+    with open(path, "rb") as f:
+        return dict(numpy.load(f).items())
+
+
+def save(world, path):
+    writeState(getState(world), path)
+
+
+def load(world, path):
+    # Initialises the uninitialised world from the checkpoint at path.
+    state = readState(path)
+    header = json.loads(str(state["header"]))
+    world.init(header["config"])
+    setState(world, state)
+    return world
+
+
+
+class CheckpointWriter():
+    # Writes checkpoints on a background thread. save() only takes a copy of
+    # the world's state, so the simulation can carry on while it's written.
+    # If checkpoints are saved faster than they can be written, save() waits
+    # for the one before to finish. A failed write is raised from the next
+    # save() or close().
+    def __init__(self):
+        self.queue = Queue.Queue(1)
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            state, path = item
+            try:
+                writeState(state, path)
+            except Exception as e:
+                self.error = e
+                print "failed to write checkpoint '{0}': {1}".format(path, e)
+
+
+    def save(self, world, path):
+        self.raiseError()
+        self.queue.put((getState(world), path))
+
+
+    def close(self):
+        # waits for the checkpoints queued so far to be written
+        self.queue.put(None)
+        self.thread.join()
+        self.raiseError()
+
+
+    def raiseError(self):
+        # raises the error of the last failed write, if there was one
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
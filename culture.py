@@ -1,4 +1,9 @@
-class AbstractCulture():
+import numpy
+
+
+class AbstractCulture(object):
+    __slots__ = ["agent", "world", "rand"]
+
     GROUPS = []
     COLORS = {}
 
@@ -19,6 +24,8 @@ class AbstractCulture():
 
 
 class BasicCulture(AbstractCulture):
+    __slots__ = []
+
     GROUPS = ["blue", "red"]
     COLORS = {
         "blue" : (0.0, 0.0, 1.0, 1.0),
@@ -33,33 +40,43 @@ class BasicCulture(AbstractCulture):
         tags = self.agent.culture_tags
         for n in self.world.getNeighbourAgents(self.agent.x, self.agent.y):
             #tag_index = rand.randint(0, min(len(n.culture.tags), len(self.tags)))
-            tag_index = self.rand.randint(0, len(self.agent.culture_tags) - 1)
-            if tags[tag_index] != n.culture_tags[tag_index]:
+            tag_index = self.rand.randint(0, self.agent.culture_length - 1)
+            if ((tags ^ n.culture_tags) >> tag_index) & 1:
                 n.culture.flip(tag_index)
 
 
     def flip(self, tag):
-        tags = self.agent.culture_tags
+        a = self.agent
 
-        if 0 <= tag < len(tags):
-            t = tags[tag]
-            if t == 0:
-                tags[tag] = 1
+        if 0 <= tag < a.culture_length:
+            bit = 1 << tag
+            a.culture_tags ^= bit
+            if a.culture_tags & bit:
+                a.culture_ones += 1
             else:
-                tags[tag] = 0
+                a.culture_ones -= 1
 
 
     def getGroup(self):
-        num0 = num1 = 0
-        for t in self.agent.culture_tags:
-            if t == 0:
-                num0 += 1
-            else:
-                num1 += 1
-
-        if num0 > num1:
+        # more 0 tags than 1 tags is blue
+        a = self.agent
+        if 2 * a.culture_ones < a.culture_length:
             return "blue"
         return "red"
 
 
+    @staticmethod
+    def getGroupIndices(pool, ids):
+        # getGroup for the agents with the given ids, as indices into GROUPS
+        return numpy.where(2 * pool.culture_ones[ids] < pool.culture_length[ids], 0, 1)
+
 
+    @staticmethod
+    def getGroupHistogram(pool):
+        # Returns the number of living agents in each group of GROUPS, using
+        # the same test as getGroup on the whole pool at once.
+        n = pool.size
+        alive = pool.alive[:n]
+        blue = alive & (2 * pool.culture_ones[:n] < pool.culture_length[:n])
+        num_blue = int(numpy.count_nonzero(blue))
+        return [num_blue, int(numpy.count_nonzero(alive)) - num_blue]
@@ -1,22 +1,66 @@
 #
 # Deals with displaying the data gathered by the Statistics class.
 #
+# The statistics are drawn as a line chart straight from the Statistics
+# buffers every frame, one vertex array per series. matplotlib is only used,
+# if it is installed, to export the chart to an image file.
+#
+# DataVisProcess runs the data visualisation in its own process, reading the
+# statistics from shared memory, so drawing the chart never holds up the
+# simulation.
+#
 
+import os, math, time, ctypes, numpy, multiprocessing
+from Queue import Empty
 from PySFML import sf
 from OpenGL.GL import *
+from statistics import StatisticsReader
+
+
+def niceStep(span, max_ticks):
+    # A step of 1, 2 or 5 times a power of 10 giving at most about max_ticks
+    # ticks over span.
+    if span <= 0:
+        return 1.0
+    rough = span / float(max_ticks)
+    power = 10.0 ** math.floor(math.log10(rough))
+    for m in (1, 2, 5, 10):
+        if m * power >= rough:
+            return m * power
+    return 10 * power
+
+
+def formatTick(v, step):
+    if step >= 1:
+        return "{0:d}".format(int(round(v)))
+    digits = int(math.ceil(-math.log10(step)))
+    return "{0:.{1}f}".format(v, digits)
 
-# do this before importing pylab or pyplot
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import StringIO, Image
 
 
 class DataVis():
+    # (Statistics name, colour) of each series drawn
+    SERIES = [
+        ("num_agents",            (0.0, 0.0, 1.0)),
+        ("num_fertile",           (0.0, 0.5, 0.0)),
+        ("num_deaths",            (1.0, 0.0, 0.0)),
+        ("num_births",            (0.0, 0.75, 0.75)),
+        ("mean_vision",           (0.75, 0.0, 0.75)),
+        ("mean_sugar_metabolism", (0.75, 0.75, 0.0)),
+        ("mean_mates",            (0.0, 0.0, 0.0)),
+        ("mean_children",         (1.0, 0.5, 0.0)),
+    ]
+
+    # space around the plot area for tick labels and the legend, in pixels
+    MARGIN_LEFT   = 60
+    MARGIN_RIGHT  = 180
+    MARGIN_TOP    = 20
+    MARGIN_BOTTOM = 40
+
+    # stats is a Statistics or StatisticsReader
     def __init__(self, stats):
         self.stats = stats
         self.window = sf.RenderWindow()
-        self.update_ticks = 30
         self.running = False
 
 
@@ -27,23 +71,11 @@ class DataVis():
         self.resized(800, 600)
         glDisable(GL_DEPTH_TEST)
 
-        self.tex_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.tex_id)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-
         self.running = True
         self.current_tick = 0
-        self.next_update_tick = 0
 
 
     def deinit(self):
-        glDeleteTextures([self.tex_id])
-        self.tex_id = 0
         self.window.Close()
         self.running = False
 
@@ -59,6 +91,10 @@ class DataVis():
             self.deinit()
 
 
+    def stop(self):
+        self.setRunning(False)
+
+
     def tick(self):
         self.doEvents()
 
@@ -67,54 +103,32 @@ class DataVis():
 
         self.current_tick += 1
 
-        if self.current_tick < self.next_update_tick:
-            return
 
-        self.updateVis()
-        self.next_update_tick = self.current_tick + self.update_ticks
+    def getSeries(self):
+        # (label, data, colour) of each series, straight from the buffers
+        return [(name, self.stats.getData(name), color) for name, color in DataVis.SERIES]
 
 
-    def updateVis(self):
-        # create figure
-        fig = plt.figure(figsize=(self.window.GetWidth()/100.0, self.window.GetHeight()/100.0), dpi=100)
+    def getRanges(self, series):
+        # the time and value ranges of the chart, values always include 0
+        t1, t2 = self.stats.getTimePeriod()
+        v1, v2 = 0.0, 1.0
+        for label, d, color in series:
+            d = d[numpy.isfinite(d)]
+            if len(d):
+                v1, v2 = min(v1, float(d.min())), max(v2, float(d.max()))
+        step = niceStep(v2 - v1, 8)
+        v1 = math.floor(v1 / step) * step
+        v2 = math.ceil(v2 / step) * step
+        return (t1, t2), (v1, v2), step
 
-        # create time data array
-        time_start, time_end = self.stats.getTimePeriod()
-        times = [i for i in range(time_start, time_end)]
 
-        # plot data on figure
-        ax = fig.add_subplot(111, xlabel="time")
-        l1 = ax.plot(times, self.stats.getNumAgentsData(), label="num_agents")
-        l3 = ax.plot(times, self.stats.getNumFertileData(), label="fertile")
-        l4 = ax.plot(times, self.stats.getNumDeathsData(), label="num_deaths")
-        l5 = ax.plot(times, self.stats.getNumBirthsData(), label="num_births")
-        l6 = ax.plot(times, self.stats.getMeanVisionData(), label="mean_vision")
-        l7 = ax.plot(times, self.stats.getMeanSugarMetabolismData(), label="mean_sugar_metabolism")
-        l8 = ax.plot(times, self.stats.getMeanMatesData(), label="mean_mates")
-        l9 = ax.plot(times, self.stats.getMeanChildrenData(), label="mean_children")
-
-        fig.legend((l1, l3, l4, l5, l6, l7, l8, l9), ("num_agents", "num_fertile", "num_deaths", "num_births", "mean_vision", "mean_sugar_metabolism", "mean_mates", "mean_children"), "best")
-        #fig.legend(l6, "mean_vision", "best")
-
-        # save figure in IO buffer
-        imgdata = StringIO.StringIO()
-        fig.savefig(imgdata, format='png')
-        imgdata.seek(0)  # rewind the data
-        plt.clf()
-        plt.close('all')
-
-        # create OpenGL texture
-        image = Image.open(imgdata)
-        iw, ih = image.size
-        glBindTexture(GL_TEXTURE_2D, self.tex_id)
-        glTexImage2D(GL_TEXTURE_2D, 0, 3, iw, ih, 0, GL_RGBA, GL_UNSIGNED_BYTE, image.tostring("raw", "RGBA", 0, -1))
-
-    
     def doEvents(self):
         event = sf.Event()
         while self.window.GetEvent(event):
-            if event.Type in [sf.Event.KeyPressed, sf.Event.KeyReleased]:
-                pass
+            if event.Type == sf.Event.KeyPressed:
+                if event.Key.Code == sf.Key.E:
+                    self.exportChart()
             elif event.Type == sf.Event.Closed:
                 self.setRunning(False)
             elif event.Type == sf.Event.Resized:
@@ -127,65 +141,133 @@ class DataVis():
 
         self.window.SetActive(True)
         glLoadIdentity()
+        glClearColor(1.0, 1.0, 1.0, 1.0)
         glClear(GL_COLOR_BUFFER_BIT)
 
-        glEnable(GL_TEXTURE_2D)
-        glColor4f(1.0, 1.0, 1.0, 1.0)
-        glBegin(GL_QUADS)
-
-        glTexCoord2f(0.0, 0.0)
-        glVertex3f( 0.0, 0.0,  0.0)
-
-        glTexCoord2f(1.0, 0.0)
-        glVertex3f( 1.0, 0.0,  0.0)
+        w, h = self.window.GetWidth(), self.window.GetHeight()
+        x1, y1 = DataVis.MARGIN_LEFT, DataVis.MARGIN_BOTTOM
+        x2, y2 = w - DataVis.MARGIN_RIGHT, h - DataVis.MARGIN_TOP
+        if x2 <= x1 or y2 <= y1:
+            self.window.Display()
+            return
 
-        glTexCoord2f(1.0, 1.0)
-        glVertex3f( 1.0,  1.0,  0.0)
+        series = self.getSeries()
+        (t1, t2), (v1, v2), v_step = self.getRanges(series)
+        t_step = niceStep(t2 - t1, 8)
+        sx = (x2 - x1) / float(max(1, t2 - t1 - 1))
+        sy = (y2 - y1) / float(v2 - v1)
+
+        # grid lines and axes
+        glColor3f(0.85, 0.85, 0.85)
+        glBegin(GL_LINES)
+        v = v1
+        while v <= v2 + v_step * 0.5:
+            y = y1 + (v - v1) * sy
+            glVertex2f(x1, y)
+            glVertex2f(x2, y)
+            v += v_step
+        t = math.ceil(t1 / t_step) * t_step
+        while t < t2:
+            x = x1 + (t - t1) * sx
+            glVertex2f(x, y1)
+            glVertex2f(x, y2)
+            t += t_step
+        glEnd()
 
-        glTexCoord2f(0.0, 1.0)
-        glVertex3f( 0.0,  1.0,  0.0)
+        glColor3f(0.0, 0.0, 0.0)
+        glBegin(GL_LINE_LOOP)
+        glVertex2f(x1, y1)
+        glVertex2f(x2, y1)
+        glVertex2f(x2, y2)
+        glVertex2f(x1, y2)
+        glEnd()
 
+        # the series, each drawn from a single vertex array
+        n = len(series[0][1])
+        vertices = numpy.empty((n, 2), numpy.float32)
+        vertices[:, 0] = x1 + numpy.arange(n) * sx
+        glEnableClientState(GL_VERTEX_ARRAY)
+        for label, data, color in series:
+            vertices[:, 1] = y1 + (numpy.nan_to_num(data) - v1) * sy
+            glColor3f(*color)
+            glVertexPointer(2, GL_FLOAT, 0, vertices)
+            glDrawArrays(GL_LINE_STRIP, 0, n)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        # legend swatches
+        glBegin(GL_QUADS)
+        for i, (label, data, color) in enumerate(series):
+            y = y2 - 20 * i - 12
+            glColor3f(*color)
+            glVertex2f(x2 + 10, y)
+            glVertex2f(x2 + 22, y)
+            glVertex2f(x2 + 22, y + 8)
+            glVertex2f(x2 + 10, y + 8)
         glEnd()
 
+        # text is drawn by SFML, whose y axis points down the window
+        v = v1
+        while v <= v2 + v_step * 0.5:
+            self.drawText(formatTick(v, v_step), 5, h - (y1 + (v - v1) * sy) - 8)
+            v += v_step
+        t = math.ceil(t1 / t_step) * t_step
+        while t < t2:
+            self.drawText(formatTick(t, t_step), x1 + (t - t1) * sx - 10, h - y1 + 4)
+            t += t_step
+        self.drawText("time", (x1 + x2) / 2, h - 18)
+        for i, (label, data, color) in enumerate(series):
+            self.drawText(label, x2 + 28, h - (y2 - 20 * i) + 2)
+
         # swap buffers
         self.window.Display()
 
 
-    def draw2(self):
-        if not self.running:
-            return
+    def drawText(self, text, x, y, size=12):
+        s = sf.String(text)
+        s.SetSize(size)
+        s.SetColor(sf.Color(0, 0, 0))
+        s.SetPosition(x, y)
+        self.window.Draw(s)
 
-        self.window.SetActive(True)
-        glLoadIdentity()
-        glClear(GL_COLOR_BUFFER_BIT)
 
-        data = [
-            self.stats.getNumAgentsData(), 
-            self.stats.getNumFertileData(),
-            self.stats.getNumDeathsData(), 
-            self.stats.getNumBirthsData(), 
-            self.stats.getMeanVisionData(),
-            self.stats.getMeanSugarMetabolismData(),
-            self.stats.getMeanMatesData(), 
-            self.stats.getMeanChildrenData(),
-        ]
-
-        max_value = 0
-        for d in data:
-            for datum in d:
-                max_value = max(datum, max_value)
-
-        glColor3f(1.0, 1.0, 1.0)
-        for d in data:
-            glBegin(GL_LINE_STRIP)
-            for x,v in enumerate(d):
-                glVertex2f(x/100.0, v/float(max_value))
-            glEnd()
+    def saveScreenshot(self, path):
+        img = self.window.Capture()
+        img.SaveToFile(path)
 
-        # swap buffers
-        self.window.Display()
 
+    def exportChart(self, path=None):
+        # Saves the chart as drawn by matplotlib, if it is installed, to path
+        # or the next free screenshots/<n>_chart.png.
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+        except ImportError:
+            print "matplotlib is needed to export charts"
+            return
 
+        if path is None:
+            num = 0
+            path = "screenshots/" + str(num).zfill(6) + "_chart.png"
+            while os.path.exists(path):
+                num = num + 1
+                path = "screenshots/" + str(num).zfill(6) + "_chart.png"
+
+        fig = plt.figure(figsize=(self.window.GetWidth()/100.0, self.window.GetHeight()/100.0), dpi=100)
+        time_start, time_end = self.stats.getTimePeriod()
+        times = range(time_start, time_end)
+
+        ax = fig.add_subplot(111, xlabel="time")
+        lines = []
+        labels = []
+        for label, data, color in self.getSeries():
+            lines.append(ax.plot(times, data, color=color, label=label))
+            labels.append(label)
+        fig.legend(lines, labels, "best")
+
+        print "saving chart '{0}'".format(path)
+        fig.savefig(path, format='png')
+        plt.close(fig)
 
 
     def resized(self, width, height):
@@ -194,40 +276,81 @@ class DataVis():
         self.window.SetActive(True)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        glOrtho(0, 1, 0, 1, -1, 1)
+        glOrtho(0, width, 0, height, -1, 1)
         glViewport(0, 0, width, height)
         glMatrixMode(GL_MODELVIEW)
 
 
-    def bleh(self):
-        if not hasattr(self, "tex_id"):
-            self.tex_id = glGenTextures(1)
-            fig = plt.figure()
-            ax = fig.add_subplot(111)
-            ax.plot([1,2,3])
-            imgdata = StringIO.StringIO()
-            fig.savefig(imgdata, format='png')
-            imgdata.seek(0)  # rewind the data
-            image = Image.open(imgdata)
-            self.ix = image.size[0]
-            self.iy = image.size[1]
-            image = image.tostring("raw", "RGBA", 0, -1)
-            glBindTexture(GL_TEXTURE_2D, self.tex_id)
-            glTexImage2D(GL_TEXTURE_2D, 0, 3, self.ix, self.iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-
-        glEnable(GL_TEXTURE_2D)
-        glColor4f(1.0, 1.0, 1.0, 1.0)
-        glBegin(GL_QUADS)
-        glTexCoord2f(0.0, 0.0); glVertex3f( 0.0, 0.0,  0.0)
-        glTexCoord2f(1.0, 0.0); glVertex3f( self.ix, 0.0,  0.0)
-        glTexCoord2f(1.0, 1.0); glVertex3f( self.ix,  self.iy,  0.0)
-        glTexCoord2f(0.0, 1.0); glVertex3f( 1.0,  self.iy,  0.0)
-        glEnd()
 
+class DataVisProcess():
+    # Runs a DataVis in another process, with the same interface as DataVis.
+    # stats must have been shared (see Statistics.share) and start() has to
+    # be called before this process opens any windows, as the new process is
+    # forked from this one and mustn't share its connection to the display.
+    def __init__(self, stats):
+        self.running = False
+        self.shared_running = multiprocessing.Value(ctypes.c_bool, False)
+        self.quit = multiprocessing.Value(ctypes.c_bool, False)
+        self.screenshots = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=runDataVis,
+            args=(StatisticsReader(stats), self.shared_running, self.screenshots, self.quit))
+        self.process.daemon = True
+
+
+    def start(self):
+        self.process.start()
+
+
+    def stop(self):
+        self.quit.value = True
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
 
+
+    def setRunning(self, running):
+        self.running = running
+        self.shared_running.value = running
+
+
+    def tick(self):
+        pass
+
+
+    def draw(self):
+        # the other process draws, but its window may have been closed
+        self.running = self.shared_running.value
+
+
+    def saveScreenshot(self, path):
+        # taken by the other process when it next draws
+        self.screenshots.put(path)
+
+
+
+def runDataVis(reader, running, screenshots, quit):
+    # the data visualisation process
+    vis = DataVis(reader)
+    while not quit.value:
+        if vis.running != running.value:
+            vis.setRunning(running.value)
+            if vis.running:
+                vis.window.SetFramerateLimit(60)
+        if not vis.running:
+            time.sleep(0.05)
+            continue
+
+        vis.tick()
+        if not vis.running:
+            running.value = False
+            continue
+
+        reader.update()
+        vis.draw()
+        try:
+            while True:
+                vis.saveScreenshot(screenshots.get_nowait())
+        except Empty:
+            pass
+
+    vis.stop()
@@ -1,9 +1,148 @@
-class Disease():
-    def __init__(self, rand, length, extra_sugar, extra_spice):
+import util
+
+
+class Disease(object):
+    # A disease definition. These are created by the world at startup and
+    # shared by every agent they infect, so they must not be changed. An
+    # agent's state for a disease is kept in an Infection.
+    __slots__ = ["id", "extra_sugar", "extra_spice", "length", "string"]
+
+    def __init__(self, rand, length, extra_sugar, extra_spice, disease_id=0):
+        # ids index the diseases in an agent's immunities bitmask. Diseases
+        # with equal strings share an id (see World.init).
+        self.id = disease_id
         self.extra_sugar = extra_sugar
         self.extra_spice = extra_spice
-        self.string = []
+
+        # the disease's bit string, packed into an int. Bit i is the i'th bit
+        # of the string.
+        self.length = length
+        self.string = 0
 
         for i in range(length):
-            self.string.append(rand.choice((1, 0)))
+            if rand.choice((1, 0)):
+                self.string |= 1 << i
+
+
+
+class Infection(object):
+    # An agent's infection with a Disease. position is where in the agent's
+    # immune system the disease is being fought, None until the first immune
+    # response.
+    __slots__ = ["disease", "position"]
+
+    def __init__(self, disease):
+        self.disease = disease
+        self.position = None
+
+
+
+#
+# Matching disease strings against immune systems.
+#
+# Immune systems and disease strings are ints with bit i holding the i'th
+# bit of the string. A disease of length n is compared with the window of n
+# bits starting at each position of the immune system; the Hamming distance
+# is the popcount of their XOR.
+#
+# The original list based matcher compared every bit of the disease against
+# the first bit of the window only and skipped the last window. With legacy
+# set these functions reproduce its results exactly.
+#
+def getWindow(immune_sys, position, length):
+    return (immune_sys >> position) & ((1 << length) - 1)
+
+
+def getWindowDistances(immune_sys, immune_len, string, length, legacy=False):
+    # Returns the distance of the disease from each window, in order.
+    if legacy:
+        # each window is treated as length copies of its first bit
+        ones = util.popcount(string)
+        return [ones if (immune_sys >> i) & 1 == 0 else length - ones
+            for i in range(immune_len - length)]
+
+    mask = (1 << length) - 1
+    return [util.popcount(((immune_sys >> i) & mask) ^ string)
+        for i in range(immune_len - length + 1)]
+
+
+def findClosestMatch(immune_sys, immune_len, string, length, legacy=False):
+    # Returns the position of the first window with the smallest distance
+    # from the disease, or 0 if every window differs in every bit.
+    min_dist, position = length, 0
+    for i, dist in enumerate(getWindowDistances(immune_sys, immune_len, string, length, legacy)):
+        if dist < min_dist:
+            min_dist = dist
+            position = i
+            if dist == 0:
+                break
+    return position
+
+
+def isImmune(immune_sys, immune_len, string, length, legacy=False):
+    if legacy:
+        # only diseases made of a single repeated bit can ever match
+        if string == 0:
+            bit = 0
+        elif string == (1 << length) - 1:
+            bit = 1
+        else:
+            return False
+        return any((immune_sys >> i) & 1 == bit for i in range(immune_len - length))
+
+    return windowsMatch(immune_sys, 0, immune_len - length, string, length)
+
+
+def windowsMatch(immune_sys, first, last, string, length):
+    # True if any window starting between first and last (inclusive) matches
+    mask = (1 << length) - 1
+    for i in range(first, last+1):
+        if (immune_sys >> i) & mask == string:
+            return True
+    return False
+
+
+#
+# Immunity bitmasks.
+#
+# Agents cache which diseases they are immune to as an int with bit d.id set
+# for each immune disease d, so an infection check is a single bit test.
+#
+def getImmunities(immune_sys, immune_len, diseases, legacy=False):
+    immunities = 0
+    for d in diseases:
+        if isImmune(immune_sys, immune_len, d.string, d.length, legacy):
+            immunities |= 1 << d.id
+    return immunities
+
+
+def updateImmunities(immunities, old_immune_sys, new_immune_sys, flipped, immune_len, diseases, legacy=False):
+    # Returns the immunities after the bit at position flipped changed from
+    # old_immune_sys to new_immune_sys. Only diseases with a window covering
+    # the flipped bit are rechecked.
+    for d in diseases:
+        n = d.length
+        bit = 1 << d.id
+
+        if legacy:
+            # legacy windows are single bits, see getWindowDistances
+            if flipped < immune_len - n:
+                if isImmune(new_immune_sys, immune_len, d.string, n, True):
+                    immunities |= bit
+                else:
+                    immunities &= ~bit
+            continue
+
+        first, last = max(0, flipped - n + 1), min(flipped, immune_len - n)
+        if first > last:
+            continue
+
+        if immunities & bit:
+            # still immune if the match was in a window the flip didn't touch
+            if (windowsMatch(old_immune_sys, first, last, d.string, n)
+                    and not isImmune(new_immune_sys, immune_len, d.string, n)):
+                immunities &= ~bit
+        elif windowsMatch(new_immune_sys, first, last, d.string, n):
+            immunities |= bit
 
+    return immunities
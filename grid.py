@@ -0,0 +1,297 @@
+#
+# Tile data for the sugarscape world, stored as a structure of arrays.
+#
+# Every tile property is kept in its own contiguous 2D numpy array indexed
+# [x][y] rather than in one object per tile. Full grid passes (growth,
+# pollution, drawing) can then work on whole arrays at a time.
+#
+
+import numpy
+
+
+def diffuse(src, dst):
+    # Sets each tile in dst to the average of its 4 neighbours in src, wrapping
+    # around the edges of the grid. The neighbours are summed in the order
+    # x-1, x+1, y-1, y+1.
+    dst[1:] = src[:-1]
+    dst[0] = src[-1]
+    dst[:-1] += src[1:]
+    dst[-1] += src[0]
+    dst[:, 1:] += src[:, :-1]
+    dst[:, 0] += src[:, -1]
+    dst[:, :-1] += src[:, 1:]
+    dst[:, -1] += src[:, 0]
+    dst /= 4.0
+
+
+# the bits set in each 4 bit mask, lowest first
+NEIGHBOUR_BITS = [tuple([k for k in range(4) if (m >> k) & 1]) for m in range(16)]
+
+
+class TileGrid():
+    # Regions and agents are stored by id. A tile with no region or no agent
+    # holds NONE in the region/agent arrays.
+    NONE = -1
+
+    # Each tile keeps a mask of which of its 4 neighbours are occupied, with
+    # bit k set for the k'th neighbour in the order x-1, x+1, y-1, y+1.
+    # NEIGHBOUR_BITS[mask] lists the neighbours set in a mask.
+    FULL = 15
+    NEIGHBOUR_BITS = NEIGHBOUR_BITS
+
+    # Changes to the tiles are recorded in blocks of 2**BLOCK_SHIFT tiles
+    # square, one bool per block in each of the DIRTY_LAYERS. The renderer
+    # clears a layer's blocks once it has redrawn them.
+    BLOCK_SHIFT = 4
+    DIRTY_LAYERS = ["sugar", "spice", "pollution", "agent"]
+
+    def __init__(self, width, height, dtype=numpy.float64):
+        self.width = width
+        self.height = height
+        self.dtype = dtype
+
+        shape = (width, height)
+        self.sugar     = numpy.zeros(shape, dtype)
+        self.spice     = numpy.zeros(shape, dtype)
+        self.max_sugar = numpy.zeros(shape, dtype)
+        self.max_spice = numpy.zeros(shape, dtype)
+        self.pollution = numpy.zeros(shape, dtype)
+
+        self.region = numpy.empty(shape, numpy.int32)
+        self.region.fill(TileGrid.NONE)
+
+        self.agent = numpy.empty(shape, numpy.int32)
+        self.agent.fill(TileGrid.NONE)
+        self.neighbours = numpy.zeros(shape, numpy.uint8)
+
+        # wrapped coordinates of the previous/next column and row
+        self.prev_x = [(x-1) % width for x in range(width)]
+        self.next_x = [(x+1) % width for x in range(width)]
+        self.prev_y = [(y-1) % height for y in range(height)]
+        self.next_y = [(y+1) % height for y in range(height)]
+
+        # with lazy regrowth, the number of ticks of growth each tile's sugar
+        # and spice include
+        self.updated = numpy.zeros(shape, numpy.int64)
+
+        # scratch space for per-tile growth rates
+        self.growth = numpy.empty(shape, dtype)
+
+        # dirty blocks, see DIRTY_LAYERS
+        b = TileGrid.BLOCK_SHIFT
+        self.block_starts_x = numpy.arange(0, width, 1 << b)
+        self.block_starts_y = numpy.arange(0, height, 1 << b)
+        block_shape = (len(self.block_starts_x), len(self.block_starts_y))
+        self.dirty_sugar     = numpy.ones(block_shape, bool)
+        self.dirty_spice     = numpy.ones(block_shape, bool)
+        self.dirty_pollution = numpy.ones(block_shape, bool)
+        self.dirty_agent     = numpy.ones(block_shape, bool)
+
+        # back buffer for pollution updates
+        self.pollution_back = numpy.zeros(shape, dtype)
+        self.pollution_back_clear = True
+
+        # Tiles that may have nonzero pollution, so pollution updates can skip
+        # the rest of the grid. pollution_active holds their flat indices
+        # (x*height + y) as of the last update, pollution_added those
+        # polluted since, and pollution_marked flags every tile in either.
+        self.pollution_active = numpy.zeros(0, numpy.int64)
+        self.pollution_added = []
+        self.pollution_marked = numpy.zeros(shape, bool)
+
+        # when more than this fraction of the tiles may be polluted the whole
+        # grid is updated instead
+        self.sparse_pollution_limit = 0.25
+
+
+    def getDirty(self, layer):
+        return getattr(self, "dirty_" + layer)
+
+
+    def markDirty(self, layer, x, y):
+        # marks the block of the wrapped tile x,y
+        b = TileGrid.BLOCK_SHIFT
+        self.getDirty(layer)[x >> b, y >> b] = True
+
+
+    def markDirtyTiles(self, dirty, tiles):
+        # marks every block with a True tile in the bool array tiles
+        rows = numpy.logical_or.reduceat(tiles, self.block_starts_x, axis=0)
+        dirty |= numpy.logical_or.reduceat(rows, self.block_starts_y, axis=1)
+
+
+    def markDirtyIndices(self, dirty, i):
+        # marks the blocks of the tiles with flat indices i
+        b = TileGrid.BLOCK_SHIFT
+        x, y = numpy.divmod(i, self.height)
+        dirty[x >> b, y >> b] = True
+
+
+    def setResources(self, sugar, spice):
+        # sugar and spice are 2D arrays (or nested lists) indexed [x][y]. The
+        # initial levels are also the maximum levels.
+        self.sugar[:] = sugar
+        self.spice[:] = spice
+        self.max_sugar[:] = self.sugar
+        self.max_spice[:] = self.spice
+
+
+    def growGlobal(self, growth):
+        self.markDirtyTiles(self.dirty_sugar, self.sugar < self.max_sugar)
+        numpy.add(self.sugar, growth, out=self.sugar)
+        numpy.minimum(self.sugar, self.max_sugar, out=self.sugar)
+
+        self.markDirtyTiles(self.dirty_spice, self.spice < self.max_spice)
+        numpy.add(self.spice, growth, out=self.spice)
+        numpy.minimum(self.spice, self.max_spice, out=self.spice)
+
+
+    def growRegional(self, sugar_rates, spice_rates):
+        # sugar_rates and spice_rates are lookup tables indexed by region id
+        # with one extra entry at the end. Tiles with no region (NONE = -1)
+        # read that last entry, which should be 0.
+        # only tiles below their maximum change
+        numpy.take(sugar_rates, self.region, out=self.growth)
+        self.markDirtyTiles(self.dirty_sugar, self.sugar < self.max_sugar)
+        numpy.add(self.sugar, self.growth, out=self.sugar)
+        numpy.minimum(self.sugar, self.max_sugar, out=self.sugar)
+
+        numpy.take(spice_rates, self.region, out=self.growth)
+        self.markDirtyTiles(self.dirty_spice, self.spice < self.max_spice)
+        numpy.add(self.spice, self.growth, out=self.spice)
+        numpy.minimum(self.spice, self.max_spice, out=self.spice)
+
+
+    def addPollution(self, x, y, amount):
+        # x, y must be wrapped
+        self.pollution[x, y] += amount
+        b = TileGrid.BLOCK_SHIFT
+        self.dirty_pollution[x >> b, y >> b] = True
+        if not self.pollution_marked.item(x, y):
+            self.pollution_marked[x, y] = True
+            self.pollution_added.append(x * self.height + y)
+
+
+    def setPollution(self, x, y, amount):
+        self.pollution[x, y] = 0
+        self.addPollution(x, y, amount)
+
+
+    def findPollution(self):
+        # Rebuilds the set of polluted tiles after a full grid update.
+        self.pollution_active = numpy.flatnonzero(self.pollution)
+        numpy.not_equal(self.pollution, 0, out=self.pollution_marked)
+        self.pollution_added = []
+        self.dirty_pollution.fill(True)
+
+
+    def decayPollution(self, decay):
+        numpy.subtract(self.pollution, decay, out=self.pollution)
+        numpy.maximum(self.pollution, 0.0, out=self.pollution)
+        self.findPollution()
+
+
+    def diffusePollution(self):
+        diffuse(self.pollution, self.pollution_back)
+        self.pollution, self.pollution_back = self.pollution_back, self.pollution
+        self.pollution_back_clear = False
+        self.findPollution()
+
+
+    def decayAndDiffusePollution(self, decay):
+        # Same as decayPollution followed by diffusePollution. Only the
+        # polluted tiles and their neighbours are updated unless too much of
+        # the grid is polluted.
+        active = self.pollution_active
+        if self.pollution_added:
+            active = numpy.union1d(active, self.pollution_added)
+
+        if len(active) > self.sparse_pollution_limit * self.pollution.size:
+            self.decayAndDiffusePollutionDense(decay)
+        else:
+            self.decayAndDiffusePollutionSparse(decay, active)
+
+
+    def decayAndDiffusePollutionDense(self, decay):
+        # The decayed values are written to the back buffer and diffused
+        # straight back into pollution, so no copies or swaps are needed.
+        back = self.pollution_back
+        numpy.subtract(self.pollution, decay, out=back)
+        numpy.maximum(back, 0.0, out=back)
+        diffuse(back, self.pollution)
+        self.pollution_back_clear = False
+        self.findPollution()
+
+
+    def decayAndDiffusePollutionSparse(self, decay, active):
+        # active holds the flat indices of every tile that may be polluted.
+        # The result is exactly that of the dense version: the neighbours
+        # are summed in the same order and all other tiles stay 0.
+        w, h = self.width, self.height
+        p = self.pollution.reshape(-1)
+        back = self.pollution_back.reshape(-1)
+        if not self.pollution_back_clear:
+            back.fill(0)
+            self.pollution_back_clear = True
+
+        # decay the polluted tiles into the (otherwise empty) back buffer
+        decayed = numpy.maximum(p[active] - decay, 0.0)
+        p[active] = 0
+        self.pollution_marked.reshape(-1)[active] = False
+
+        polluted = decayed != 0
+        src = active[polluted]
+        back[src] = decayed[polluted]
+
+        # only the neighbours of tiles that are still polluted can end up
+        # with any pollution
+        x, y = numpy.divmod(src, h)
+        dst = numpy.unique(numpy.concatenate((
+            ((x-1) % w)*h + y, ((x+1) % w)*h + y, x*h + (y-1) % h, x*h + (y+1) % h)))
+
+        x, y = numpy.divmod(dst, h)
+        total = back[((x-1) % w)*h + y]
+        total += back[((x+1) % w)*h + y]
+        total += back[x*h + (y-1) % h]
+        total += back[x*h + (y+1) % h]
+        total /= 4.0
+        back[src] = 0
+
+        p[dst] = total
+        self.markDirtyIndices(self.dirty_pollution, active)
+        self.markDirtyIndices(self.dirty_pollution, dst)
+        self.pollution_active = dst[total != 0]
+        self.pollution_marked.reshape(-1)[self.pollution_active] = True
+        self.pollution_added = []
+
+
+    def setAgent(self, x, y, agent_id):
+        # Puts agent_id (or NONE) on the wrapped tile x,y and updates the
+        # neighbour masks of the tiles around it.
+        self.agent[x, y] = agent_id
+        b = TileGrid.BLOCK_SHIFT
+        self.dirty_agent[x >> b, y >> b] = True
+
+        n = self.neighbours
+        px, nx = self.prev_x[x], self.next_x[x]
+        py, ny = self.prev_y[y], self.next_y[y]
+        if agent_id == TileGrid.NONE:
+            n[nx, y] &= ~1
+            n[px, y] &= ~2
+            n[x, ny] &= ~4
+            n[x, py] &= ~8
+        else:
+            n[nx, y] |= 1
+            n[px, y] |= 2
+            n[x, ny] |= 4
+            n[x, py] |= 8
+
+
+    def getNeighbourCoords(self, x, y):
+        # wrapped coordinates of the neighbours of the wrapped tile x,y, in
+        # the order of the bits in the neighbour masks
+        return ((self.prev_x[x], y), (self.next_x[x], y), (x, self.prev_y[y]), (x, self.next_y[y]))
+
+
+    def wrap(self, x, y):
+        return x % self.width, y % self.height
@@ -0,0 +1,104 @@
+#
+# Runs the sugarscape simulation without a display.
+#
+# Nothing here (or in the modules it imports) may depend on PySFML or
+# OpenGL, so runs can be made on machines without a display.
+#
+
+import os, csv, time, checkpoint
+from world import World
+
+
+class Headless(World):
+    def __init__(self):
+        World.__init__(self)
+        self.verbose = False
+
+
+    def run(self, data_file_path, num_ticks, output_dir, history=False, checkpoint_path=None, checkpoint_ticks=1000):
+        # If history is True the statistics' full time series are also
+        # written to <output_dir>/<statistic>.bin as raw binary arrays.
+        #
+        # With checkpoint_path a checkpoint is written there every
+        # checkpoint_ticks ticks. If there is one there already the run
+        # carries on from it, dropping any statistics written after it.
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        stats_path = os.path.join(output_dir, "stats.csv")
+        rows = []
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            if history:
+                print "the statistics' history isn't written when carrying on from a checkpoint"
+            checkpoint.load(self, checkpoint_path)
+            print "carrying on from tick {0} of '{1}'".format(self.current_tick, checkpoint_path)
+            if os.path.exists(stats_path):
+                rows = list(csv.reader(open(stats_path, "rb")))[1:]
+                rows = [row for row in rows if int(row[0]) <= self.current_tick]
+        else:
+            if history:
+                self.stats_spill_dir = output_dir
+            self.init(data_file_path)
+
+        stats_file = open(stats_path, "wb")
+        writer = csv.writer(stats_file)
+        writer.writerow(["tick"] + [name for name, v in self.stats.getLatestData()])
+        if rows:
+            writer.writerows(rows)
+        else:
+            self.writeStats(writer)
+
+        checkpoints = None
+        if checkpoint_path is not None:
+            checkpoints = checkpoint.CheckpointWriter()
+
+        start_time = time.time()
+        start_tick = self.current_tick
+
+        while self.current_tick < num_ticks:
+            self.tick()
+            self.stats.tick()
+            self.writeStats(writer)
+
+            if checkpoints is not None and self.current_tick % checkpoint_ticks == 0:
+                # the statistics up to the checkpoint must be on disk first
+                stats_file.flush()
+                checkpoints.save(self, checkpoint_path)
+
+        elapsed = time.time() - start_time
+        stats_file.close()
+        self.stats.close()
+        if checkpoints is not None:
+            checkpoints.close()
+
+        ticks = self.current_tick - start_tick
+        print "ran {0} ticks in {1:.2f}s ({2:.1f} ticks/s)".format(ticks, elapsed, ticks / max(elapsed, 1e-9))
+
+
+    def runStats(self, data_file_path, num_ticks):
+        # Runs num_ticks ticks without writing anything. Returns the names of
+        # the statistics and a row of [tick] + values for every tick,
+        # including the initial state.
+        self.init(data_file_path)
+        names = [name for name, v in self.stats.getLatestData()]
+        rows = [self.getStatsRow()] + self.tickStats(num_ticks)
+        self.stats.close()
+        return names, rows
+
+
+    def tickStats(self, num_ticks):
+        # runs num_ticks more ticks, returning their rows as for runStats
+        rows = []
+        for i in range(num_ticks):
+            self.tick()
+            self.stats.tick()
+            rows.append(self.getStatsRow())
+        return rows
+
+
+    def getStatsRow(self):
+        return [self.current_tick] + [v for name, v in self.stats.getLatestData()]
+
+
+    def writeStats(self, writer):
+        writer.writerow(self.getStatsRow())
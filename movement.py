@@ -0,0 +1,128 @@
+#
+# Batched agent movement.
+#
+# Agent.findBestLocation walks each agent's vision cross in Python and rates
+# every tile one at a time. BatchMovement instead gathers the vision crosses
+# of all agents into index arrays and rates every candidate tile in one go
+# with numpy. Each agent keeps a short list of its best candidates, ordered
+# the same way Agent.findBestLocation would pick them.
+#
+# Moves are still resolved one agent at a time in the world's (shuffled)
+# agent order, so an agent never moves onto a tile another agent took
+# earlier in the tick. Tile ratings use the tiles at the start of the agent
+# phase and the reserves agents will have once they have metabolised, though,
+# so this is opt-in ("batch_movement" in the config) and does not reproduce
+# the sequential results exactly.
+#
+
+import numpy
+
+
+class BatchMovement():
+    # directions an agent can look in, in the order Agent.findBestLocation
+    # lists them before shuffling.
+    DIRS = numpy.array([(0, 1), (0, -1), (1, 0), (-1, 0)])
+
+    def __init__(self, world, keep=8, chunk_size=4096):
+        self.world = world
+        # number of best candidates remembered per agent
+        self.keep = keep
+        # number of agents whose vision crosses are evaluated at once
+        self.chunk_size = chunk_size
+
+
+    def plan(self, agents):
+        # Rank the tiles each agent can see. Must be called before any of the
+        # agents metabolise or move.
+        self.agents = agents
+        n = len(agents)
+        self.best_x = numpy.empty((n, self.keep), numpy.int64)
+        self.best_y = numpy.empty((n, self.keep), numpy.int64)
+        self.num_best = numpy.zeros(n, numpy.int64)
+
+        if n == 0:
+            return
+
+        # Use the world's RNG to seed the direction shuffles so runs stay
+        # reproducible.
+        rs = numpy.random.RandomState(self.world.rand.getrandbits(32))
+
+        for start in range(0, n, self.chunk_size):
+            self.planChunk(agents[start:start+self.chunk_size], start, rs)
+
+
+    def planChunk(self, agents, start, rs):
+        w, h = self.world.getWorldSize()
+        g = self.world.grid
+        n = len(agents)
+
+        pool = self.world.agent_pool
+        ids = numpy.array([a.id for a in agents], numpy.int64)
+        x1 = pool.x[ids]
+        y1 = pool.y[ids]
+        vision = pool.vision[ids]
+        m1 = pool.sugar_metabolism[ids] + pool.disease_sugar_metabolism[ids]
+        m2 = pool.spice_metabolism[ids] + pool.disease_spice_metabolism[ids]
+        # the reserves each agent will have after metabolising at its turn,
+        # agents left with less than nothing will starve and not move
+        sugar = numpy.maximum(pool.sugar[ids] - m1, 0.0)
+        spice = numpy.maximum(pool.spice[ids] - m2, 0.0)
+        mt = m1 + m2
+        e1 = (m1 / mt)[:, None]
+        e2 = (m2 / mt)[:, None]
+
+        # Candidate c=0 is the agent's own tile, followed by each direction's
+        # tiles from nearest to furthest. Directions are shuffled per agent.
+        v = max(1, vision.max())
+        dirs = BatchMovement.DIRS[rs.rand(n, 4).argsort(axis=1)]
+        steps = numpy.arange(1, v+1)
+        dx = (dirs[:, :, 0, None] * steps).reshape(n, 4*v)
+        dy = (dirs[:, :, 1, None] * steps).reshape(n, 4*v)
+        in_sight = numpy.tile(steps, 4)[None, :] <= vision[:, None]
+
+        x2 = numpy.hstack((x1[:, None], x1[:, None] + dx))
+        y2 = numpy.hstack((y1[:, None], y1[:, None] + dy))
+        valid = numpy.hstack((numpy.ones((n, 1), bool), in_sight))
+
+        # welfare formula from p.97, as in Agent.rateTile
+        wx, wy = x2 % w, y2 % h
+        if self.world.lazy_regrowth:
+            self.world.regrowTiles(wx.ravel(), wy.ravel())
+        w1 = sugar[:, None] + g.sugar[wx, wy]
+        w2 = spice[:, None] + g.spice[wx, wy]
+        value = (w1 ** e1) * (w2 ** e2) / (1.0 + g.pollution[wx, wy])
+        value[~valid] = -numpy.inf
+
+        # the distance measure used by Agent.findBestLocation
+        dist = (x2 - x1[:, None] * x2 - x1[:, None]) + (y2 - y1[:, None] * x2 - y1[:, None])
+        dist[:, 0] = 0
+
+        # Agent.findBestLocation keeps the highest value, then the smallest
+        # distance, then the first tile found.
+        order = numpy.arange(x2.shape[1])
+        ranked = numpy.lexsort((numpy.broadcast_to(order, value.shape), dist, -value), axis=1)
+        ranked = ranked[:, :self.keep]
+
+        rows = numpy.arange(n)[:, None]
+        k = ranked.shape[1]
+        self.best_x[start:start+n, :k] = x2[rows, ranked]
+        self.best_y[start:start+n, :k] = y2[rows, ranked]
+
+        # Only candidates up to and including the agent's own tile are needed;
+        # the agent's own tile is always free for it to stay on.
+        stay = (ranked == 0)
+        self.num_best[start:start+n] = numpy.where(stay.any(axis=1), stay.argmax(axis=1) + 1, k)
+
+
+    def resolve(self, i):
+        # Returns the tile agent i (in the order given to plan) moves to,
+        # skipping tiles that have been occupied by the agents before it.
+        a = self.agents[i]
+        world = self.world
+        for c in range(self.num_best.item(i)):
+            x, y = self.best_x.item(i, c), self.best_y.item(i, c)
+            if (x == a.x and y == a.y) or not world.isTileOccupied(x, y):
+                return x, y
+
+        # every remembered candidate was taken, let the agent look itself
+        return a.findBestLocation()
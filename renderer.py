@@ -0,0 +1,252 @@
+#
+# Array based drawing.
+#
+# Drawing every tile and agent with glBegin/glVertex costs several PyOpenGL
+# calls per quad. Instead, tile colours are uploaded as a texture with one
+# texel per tile, and agents are drawn as one array of quads. Both are
+# drawn with a handful of GL calls no matter how big the world is.
+#
+# Only the parts of the texture that changed need to be uploaded each frame,
+# see TileGrid's dirty blocks and dirtyRects. TileMap also only updates and
+# draws the tiles on screen, and switches to textures holding the means of
+# blocks of tiles when zoomed out, so drawing costs depend on the size of
+# the window rather than the size of the world.
+#
+
+import numpy
+from OpenGL.GL import *
+from grid import TileGrid
+
+
+def toBytes(c, out):
+    # converts colour values in [0, 1] (or a single value) to bytes
+    c = numpy.clip(c, 0.0, 1.0) * 255.0 + 0.5
+    out[...] = c
+
+
+def downsample(v, level):
+    # Returns the means of the 2**level square cells of the 2D array v. Cells
+    # at the far edges are smaller if the size of v isn't a multiple of the
+    # cell size.
+    n = 1 << level
+    sx = numpy.arange(0, v.shape[0], n)
+    sy = numpy.arange(0, v.shape[1], n)
+    total = numpy.add.reduceat(numpy.add.reduceat(v, sx, axis=0), sy, axis=1)
+    cx = numpy.diff(numpy.append(sx, v.shape[0]))
+    cy = numpy.diff(numpy.append(sy, v.shape[1]))
+    return total / numpy.outer(cx, cy).astype(numpy.float64)
+
+
+def dirtyRects(dirty, block_size, width, height, bx1=0, by1=0):
+    # Returns (x1, y1, x2, y2) tile rectangles (exclusive of x2, y2) covering
+    # the True blocks in the bool array dirty, whose first block is bx1, by1.
+    # Dirty blocks next to each other in a column of blocks are merged into
+    # one rectangle.
+    rects = []
+    for bx, column in enumerate(dirty, bx1):
+        by = 0
+        n = len(column)
+        while by < n:
+            if not column[by]:
+                by += 1
+                continue
+            start = by
+            while by < n and column[by]:
+                by += 1
+            rects.append((bx * block_size, (by1 + start) * block_size,
+                min((bx+1) * block_size, width), min((by1 + by) * block_size, height)))
+    return rects
+
+
+
+class TileTexture():
+    # A texture with one texel per tile. Colour channels are given as arrays
+    # indexed [x][y] like the world's TileGrid.
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+
+        # texture rows are y, so pixels are indexed [y][x]
+        self.pixels = numpy.zeros((height, width, 3), numpy.uint8)
+
+        self.id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, self.pixels)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+
+    def setColors(self, r, g, b, x=0, y=0):
+        # r, g and b are arrays indexed [x][y] or single values, in [0, 1].
+        # The arrays may cover just part of the tiles, starting at tile x,y.
+        w, h = self.width - x, self.height - y
+        for c in (r, g, b):
+            if numpy.ndim(c) == 2:
+                w, h = numpy.shape(c)
+
+        pixels = self.pixels[y:y+h, x:x+w]
+        for i, c in enumerate((r, g, b)):
+            toBytes(numpy.transpose(c), pixels[:, :, i])
+
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, w, h, GL_RGB, GL_UNSIGNED_BYTE, numpy.ascontiguousarray(pixels))
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+
+    def draw(self, texel_size, x1=0, y1=0, x2=None, y2=None):
+        # Draws texels x1 to x2, y1 to y2 (exclusive, and may be fractional)
+        # as a quad with each texel texel_size units square.
+        if x2 is None:
+            x2 = self.width
+        if y2 is None:
+            y2 = self.height
+        u1, v1 = float(x1) / self.width, float(y1) / self.height
+        u2, v2 = float(x2) / self.width, float(y2) / self.height
+        x1, y1, x2, y2 = x1 * texel_size, y1 * texel_size, x2 * texel_size, y2 * texel_size
+
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glColor3f(1.0, 1.0, 1.0)
+        glBegin(GL_QUADS)
+        glTexCoord2f(u1, v1); glVertex2f(x1, y1)
+        glTexCoord2f(u2, v1); glVertex2f(x2, y1)
+        glTexCoord2f(u2, v2); glVertex2f(x2, y2)
+        glTexCoord2f(u1, v2); glVertex2f(x1, y2)
+        glEnd()
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDisable(GL_TEXTURE_2D)
+
+
+
+class TileMap():
+    # Draws the layers of a TileGrid (see TileGrid.DIRTY_LAYERS) using a
+    # TileTexture per level of detail. Level k has a texel for every 2**k
+    # square of tiles, holding the mean of their values. Levels go up to the
+    # size of the grid's dirty blocks so blocks always cover whole texels.
+    def __init__(self, grid):
+        self.grid = grid
+        self.max_level = TileGrid.BLOCK_SHIFT
+
+        n = self.max_level + 1
+        self.textures = [None] * n
+        # the layer each level's texture holds, and the blocks of it that
+        # changed since they were last uploaded
+        self.layers = [None] * n
+        self.pending = [numpy.ones(grid.dirty_sugar.shape, bool) for i in range(n)]
+
+
+    def getLevel(self, tile_pixels):
+        # the level to use when tiles are tile_pixels screen pixels wide
+        level = 0
+        while tile_pixels < 1.0 and level < self.max_level:
+            tile_pixels *= 2
+            level += 1
+        return level
+
+
+    def getTexture(self, level):
+        if self.textures[level] is None:
+            n = (1 << level) - 1
+            self.textures[level] = TileTexture((self.grid.width + n) >> level, (self.grid.height + n) >> level)
+        return self.textures[level]
+
+
+    def getBlockRect(self, x1, y1, x2, y2):
+        # The tiles of the dirty blocks covering tiles x1 to x2, y1 to y2
+        # (exclusive). draw() reads whole blocks, so these are the tiles it
+        # may read.
+        g = self.grid
+        b = TileGrid.BLOCK_SHIFT
+        size = 1 << b
+        return ((x1 >> b) << b, (y1 >> b) << b,
+            min(((x2 + size - 1) >> b) << b, g.width), min(((y2 + size - 1) >> b) << b, g.height))
+
+
+    def draw(self, layer, values, colors, level, tile_size, x1, y1, x2, y2):
+        # Draws the tiles x1 to x2, y1 to y2 (exclusive) of layer. values(xs,
+        # ys) returns the values of the tiles in the slices xs, ys and
+        # colors(v) the r, g, b of an array of (mean) values.
+        g = self.grid
+        dirty = g.getDirty(layer)
+        for pending in self.pending:
+            pending |= dirty
+        dirty.fill(False)
+
+        if self.layers[level] != layer:
+            self.layers[level] = layer
+            self.pending[level].fill(True)
+
+        # blocks on screen
+        b = TileGrid.BLOCK_SHIFT
+        size = 1 << b
+        bx1, by1 = x1 >> b, y1 >> b
+        bx2, by2 = (x2 + size - 1) >> b, (y2 + size - 1) >> b
+        if bx1 >= bx2 or by1 >= by2:
+            return
+
+        texture = self.getTexture(level)
+        pending = self.pending[level][bx1:bx2, by1:by2]
+        if numpy.count_nonzero(pending) * 2 > pending.size:
+            # mostly changed, update the whole area in one go
+            rects = [(bx1 * size, by1 * size, min(bx2 * size, g.width), min(by2 * size, g.height))]
+        else:
+            rects = dirtyRects(pending, size, g.width, g.height, bx1, by1)
+
+        for rx1, ry1, rx2, ry2 in rects:
+            v = values(slice(rx1, rx2), slice(ry1, ry2))
+            if level:
+                v = downsample(v, level)
+            r, gr, bl = colors(v)
+            texture.setColors(r, gr, bl, rx1 >> level, ry1 >> level)
+        pending.fill(False)
+
+        n = float(1 << level)
+        texture.draw(tile_size * n, (bx1 * size) >> level, (by1 * size) >> level,
+            min(bx2 * size, g.width) / n, min(by2 * size, g.height) / n)
+
+
+
+class QuadArray():
+    # Draws equally sized, coloured squares with a single glDrawArrays call.
+
+    # corners of a quad, in drawing order
+    CORNERS = numpy.array([(0, 0), (1, 0), (1, 1), (0, 1)], numpy.float32)
+
+    def __init__(self, size):
+        self.size = size
+        self.vertices = numpy.zeros((0, 2), numpy.float32)
+        self.colors = numpy.zeros((0, 4), numpy.uint8)
+
+
+    def setQuads(self, x, y, colors):
+        # x, y are arrays of the bottom left corners of the quads. colors is
+        # an array of (r, g, b, a) rows in [0, 1], one per quad, or a single
+        # (r, g, b, a).
+        n = len(x)
+        corners = QuadArray.CORNERS * self.size
+
+        vertices = numpy.empty((n, 4, 2), numpy.float32)
+        vertices[:, :, 0] = numpy.asarray(x, numpy.float32)[:, None] + corners[:, 0]
+        vertices[:, :, 1] = numpy.asarray(y, numpy.float32)[:, None] + corners[:, 1]
+        self.vertices = vertices.reshape(n*4, 2)
+
+        c = numpy.empty((n, 4, 4), numpy.uint8)
+        toBytes(numpy.asarray(colors, numpy.float64).reshape(-1, 1, 4), c)
+        self.colors = c.reshape(n*4, 4)
+
+
+    def draw(self):
+        if len(self.vertices) == 0:
+            return
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, self.vertices)
+        glColorPointer(4, GL_UNSIGNED_BYTE, 0, self.colors)
+        glDrawArrays(GL_QUADS, 0, len(self.vertices))
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
@@ -0,0 +1,176 @@
+#
+# An on-disk cache of headless simulation runs.
+#
+# Runs are looked up by a hash of everything that decides their outcome: the
+# config as loaded (with any overrides and the random seed actually used),
+# the contents of the map images and the version of the simulation code,
+# along with the number of ticks run. Each entry holds the run's statistics
+# at every tick, a snapshot of the final tile layers and agent columns (see
+# SnapshotBuffer) and a checkpoint of the final state, so a longer run with
+# the same key can carry on from the end of a cached shorter one.
+#
+# Entries are kept as one file each in the cache directory. Reading an entry
+# touches its file, and once the directory holds more than max_bytes the
+# least recently used entries are removed.
+#
+
+import os, glob, json, hashlib, numpy, checkpoint
+from snapshot import SnapshotBuffer
+
+
+# version of the layout of cache entries, part of every key
+FORMAT_VERSION = 2
+
+# the modules whose code the outcome of a headless run depends on
+ENGINE_MODULES = ["world", "agent", "agent_pool", "culture", "disease", "grid",
+    "movement", "schedule", "statistics", "util", "headless", "checkpoint"]
+
+engine_version = None
+
+def getEngineVersion():
+    # a hash of the source of ENGINE_MODULES
+    global engine_version
+    if engine_version is None:
+        m = hashlib.sha1()
+        base = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_MODULES:
+            m.update(open(os.path.join(base, name + ".py"), "rb").read())
+        engine_version = m.hexdigest()
+    return engine_version
+
+
+def hashFile(path):
+    return hashlib.sha1(open(path, "rb").read()).hexdigest()
+
+
+def packRows(rows):
+    # Stats rows as one array per column, so columns of counts are kept as
+    # ints and columns of means as floats.
+    columns = zip(*rows)
+    arrays = dict(("row_column_{0}".format(i), numpy.array(c)) for i, c in enumerate(columns))
+    arrays["num_row_columns"] = numpy.array(len(columns))
+    return arrays
+
+
+def unpackRows(entry):
+    # the rows packed by packRows, as lists of python ints and floats
+    columns = [entry["row_column_{0}".format(i)].tolist() for i in range(int(entry["num_row_columns"]))]
+    return [list(row) for row in zip(*columns)]
+
+
+
+class RunCache():
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+
+    def getKey(self, world):
+        # the key of an initialised world's runs
+        config = dict(world.data_file)
+        config["random_seed"] = world.seed
+        images = dict((name, hashFile(config[name])) for name in ("sugar_file", "spice_file", "regions_file"))
+        desc = json.dumps({"config": config, "images": images, "engine": getEngineVersion(),
+            "format": FORMAT_VERSION}, sort_keys=True)
+        return hashlib.sha1(desc).hexdigest()
+
+
+    def getPath(self, key, num_ticks):
+        return os.path.join(self.cache_dir, "{0}-{1}.npz".format(key, num_ticks))
+
+
+    def load(self, key, num_ticks):
+        # Returns the entry for key's run of num_ticks ticks as a dict of
+        # names, the row_column_<i> arrays (see packRows), the tile_<layer>
+        # and agent_<column> snapshot arrays and the state_<name> checkpoint
+        # arrays, or None if it isn't cached.
+        path = self.getPath(key, num_ticks)
+        try:
+            with open(path, "rb") as f:
+                entry = dict(numpy.load(f).items())
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return entry
+
+
+    def findShorter(self, key, num_ticks):
+        # the longest cached run of key shorter than num_ticks ticks, or None
+        prefix = os.path.join(self.cache_dir, key + "-")
+        ticks = []
+        for path in glob.glob(prefix + "*.npz"):
+            try:
+                ticks.append(int(path[len(prefix):-len(".npz")]))
+            except ValueError:
+                pass
+        ticks = [t for t in ticks if t < num_ticks]
+        return max(ticks) if ticks else None
+
+
+    def store(self, key, num_ticks, names, rows, world):
+        arrays = packRows(rows)
+        arrays["names"] = numpy.array(names)
+        for name, dtype in SnapshotBuffer.TILE_LAYERS:
+            arrays["tile_" + name] = getattr(world.grid, name)
+        pool = world.agent_pool
+        for name, dtype in SnapshotBuffer.AGENT_COLUMNS:
+            arrays["agent_" + name] = getattr(pool, name)[:pool.size]
+        for name, v in checkpoint.getState(world).items():
+            arrays["state_" + name] = v
+
+        # written under a temporary name first so other processes never see
+        # half written entries
+        path = self.getPath(key, num_ticks)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            numpy.savez(f, **arrays)
+        os.rename(tmp_path, path)
+        self.evict()
+
+
+    def evict(self):
+        # removes the least recently used entries until the cache fits
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+    def runStats(self, world, data_file_path, num_ticks):
+        # Headless.runStats, taking the result from the cache if it's there
+        # and adding it otherwise. Runs carry on from the longest shorter
+        # run in the cache, if any.
+        world.init(data_file_path)
+        key = self.getKey(world)
+        entry = self.load(key, num_ticks)
+        if entry is not None:
+            return entry["names"].tolist(), unpackRows(entry)
+
+        names = [name for name, v in world.stats.getLatestData()]
+        rows = [world.getStatsRow()]
+        shorter = self.findShorter(key, num_ticks)
+        entry = self.load(key, shorter) if shorter is not None else None
+        if entry is not None:
+            state = dict((name[len("state_"):], v) for name, v in entry.items() if name.startswith("state_"))
+            checkpoint.setState(world, state)
+            rows = unpackRows(entry)
+
+        rows += world.tickStats(num_ticks - world.current_tick)
+        world.stats.close()
+        self.store(key, num_ticks, names, rows, world)
+        return names, rows
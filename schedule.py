@@ -0,0 +1,168 @@
+#
+# Closed form season schedules.
+#
+# A region's seasons repeat in a fixed cycle, so the total growth a region
+# has produced after any number of ticks can be worked out directly instead
+# of by stepping through the ticks. This is used by the world's lazy regrowth
+# mode, which only brings a tile's resources up to date when it is read.
+#
+# Seasons change the way regions originally stepped through them one tick at
+# a time: a season with ticks=T lasts max(T, 1) ticks, except that a first
+# season with ticks=0 is skipped at the start of the run.
+#
+
+import bisect, heapq, numpy
+
+
+class SeasonSchedule():
+    def __init__(self, seasons):
+        self.durations = [max(s.ticks, 1) for s in seasons]
+        self.sugar_rates = [s.sugar_growth for s in seasons]
+        self.spice_rates = [s.spice_growth for s in seasons]
+
+        # ticks into the cycle at which each season starts, and the growth of
+        # the cycle up to that point
+        self.starts = []
+        self.sugar_totals = []
+        self.spice_totals = []
+        t = sugar = spice = 0
+        for d, r1, r2 in zip(self.durations, self.sugar_rates, self.spice_rates):
+            self.starts.append(t)
+            self.sugar_totals.append(sugar)
+            self.spice_totals.append(spice)
+            t += d
+            sugar += d * r1
+            spice += d * r2
+
+        self.length = t
+        self.cycle_sugar = sugar
+        self.cycle_spice = spice
+
+        # tick 0 of the run is this many ticks into the cycle
+        self.offset = 1 if seasons[0].ticks <= 0 else 0
+        self.base_sugar, self.base_spice = self.cycleGrowth(self.offset)
+
+        self.np_starts = numpy.array(self.starts)
+        self.np_sugar_totals = numpy.array(self.sugar_totals, numpy.float64)
+        self.np_spice_totals = numpy.array(self.spice_totals, numpy.float64)
+        self.np_sugar_rates = numpy.array(self.sugar_rates, numpy.float64)
+        self.np_spice_rates = numpy.array(self.spice_rates, numpy.float64)
+
+
+    def isMonotonic(self):
+        # True if resources never shrink, which lazy regrowth relies on
+        return min(self.sugar_rates) >= 0 and min(self.spice_rates) >= 0
+
+
+    def hasIntegerRates(self):
+        # True if every growth rate is a whole number. Lazy regrowth adds up
+        # growth in a different order to growing every tick, which only gives
+        # exactly the same floats when the rates are whole numbers.
+        return all(float(r).is_integer() for r in self.sugar_rates + self.spice_rates)
+
+
+    def getSeasonIndex(self, t):
+        # index of the season active during tick t of the run
+        return bisect.bisect_right(self.starts, (t + self.offset) % self.length) - 1
+
+
+    def getNextChange(self, t):
+        # the first tick after t at which a new season starts, or None if
+        # there is only one season
+        if len(self.starts) == 1:
+            return None
+        p = (t + self.offset) % self.length
+        i = bisect.bisect_right(self.starts, p) - 1
+        return t + self.starts[i] + self.durations[i] - p
+
+
+    def cycleGrowth(self, p):
+        # (sugar, spice) grown in the first p ticks counted from the start of
+        # the cycle
+        cycles, p = divmod(p, self.length)
+        i = bisect.bisect_right(self.starts, p) - 1
+        n = p - self.starts[i]
+        return (cycles * self.cycle_sugar + self.sugar_totals[i] + n * self.sugar_rates[i],
+                cycles * self.cycle_spice + self.spice_totals[i] + n * self.spice_rates[i])
+
+
+    def totalGrowth(self, t):
+        # (sugar, spice) grown during ticks 0 to t-1 of the run
+        sugar, spice = self.cycleGrowth(t + self.offset)
+        return sugar - self.base_sugar, spice - self.base_spice
+
+
+    def totalGrowthArray(self, t):
+        # totalGrowth for an array of ticks
+        cycles, p = numpy.divmod(t + self.offset, self.length)
+        i = numpy.searchsorted(self.np_starts, p, side="right") - 1
+        n = p - self.np_starts[i]
+        sugar = cycles * self.cycle_sugar + self.np_sugar_totals[i] + n * self.np_sugar_rates[i]
+        spice = cycles * self.cycle_spice + self.np_spice_totals[i] + n * self.np_spice_rates[i]
+        return sugar - self.base_sugar, spice - self.base_spice
+
+
+
+class SeasonCalendar():
+    # Tracks the current season of every region. Season changes are kept in
+    # a priority queue of (tick, region index), so only regions whose season
+    # actually changes are looked at each tick.
+    #
+    # sugar_growth and spice_growth hold the growth rate of each region's
+    # current season, with an extra last entry of 0 for tiles without a
+    # region, ready to be used as lookup tables by TileGrid.growRegional.
+    def __init__(self, schedules, dtype=numpy.float64):
+        self.schedules = schedules
+        n = len(schedules)
+        self.season_index = [0] * n
+        self.sugar_growth = numpy.zeros(n+1, dtype)
+        self.spice_growth = numpy.zeros(n+1, dtype)
+
+        # the tick each region's current season started and the region's
+        # total growth before it, for totalGrowth
+        self.change_tick = numpy.zeros(n+1, numpy.int64)
+        self.change_sugar = numpy.zeros(n+1, numpy.float64)
+        self.change_spice = numpy.zeros(n+1, numpy.float64)
+
+        self.events = []
+        for i in range(n):
+            self.setSeason(i, 0)
+        heapq.heapify(self.events)
+
+
+    def setSeason(self, i, t):
+        # sets region i to its season at tick t, which starts a new season
+        s = self.schedules[i]
+        j = s.getSeasonIndex(t)
+        self.season_index[i] = j
+        self.sugar_growth[i] = s.sugar_rates[j]
+        self.spice_growth[i] = s.spice_rates[j]
+        self.change_tick[i] = t
+        self.change_sugar[i], self.change_spice[i] = s.totalGrowth(t)
+
+        next_t = s.getNextChange(t)
+        if next_t is not None:
+            heapq.heappush(self.events, (next_t, i))
+
+
+    def advance(self, t):
+        # Moves every region on to its season at tick t. Returns the indices
+        # of the regions whose season changed. Must be called for ticks in
+        # increasing order.
+        changed = []
+        while self.events and self.events[0][0] <= t:
+            i = heapq.heappop(self.events)[1]
+            self.setSeason(i, t)
+            changed.append(i)
+        return changed
+
+
+    def totalGrowth(self, t, sugar_out, spice_out):
+        # Writes each region's total growth during ticks 0 to t-1 into
+        # sugar_out and spice_out, valid while tick t-1 is in the current
+        # seasons.
+        n = t - self.change_tick
+        numpy.multiply(self.sugar_growth, n, out=sugar_out)
+        numpy.add(sugar_out, self.change_sugar, out=sugar_out)
+        numpy.multiply(self.spice_growth, n, out=spice_out)
+        numpy.add(spice_out, self.change_spice, out=spice_out)
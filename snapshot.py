@@ -0,0 +1,231 @@
+#
+# Running the simulation in its own process.
+#
+# The simulation process ticks as fast as it can and every so often copies
+# the state needed for drawing (tile layers and agent columns) into a
+# SnapshotBuffer in shared memory. The display process reads the latest
+# snapshot at its own frame rate, so slow frames don't slow the simulation
+# down and vice versa. With lazy regrowth the tiles are published as they
+# are, along with the tick they were last grown to, and the display process
+# only regrows the ones it draws. Statistics are sent for every tick over a queue so
+# none are lost.
+#
+# Nothing here may depend on PySFML or OpenGL.
+#
+
+import time, ctypes, numpy, multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from Queue import Empty
+
+
+class SnapshotBuffer():
+    # Two slots of shared memory, each able to hold the state of the whole
+    # world. The writer fills the slot the reader isn't using and then makes
+    # it the front slot. If the reader is still holding on to the other slot
+    # the snapshot is dropped rather than making the writer wait.
+
+    # (name, dtype) of the TileGrid layers and AgentPool columns copied
+    TILE_LAYERS = [
+        ("sugar",     numpy.float32),
+        ("spice",     numpy.float32),
+        ("pollution", numpy.float32),
+        ("agent",     numpy.int32),
+        ("updated",   numpy.int64),
+    ]
+    AGENT_COLUMNS = [
+        ("alive",          numpy.bool_),
+        ("x",              numpy.int32),
+        ("y",              numpy.int32),
+        ("gender",         numpy.int8),
+        ("sugar",          numpy.float32),
+        ("spice",          numpy.float32),
+        ("num_diseases",   numpy.int32),
+        ("culture_ones",   numpy.int32),
+        ("culture_length", numpy.int32),
+    ]
+
+    # header fields
+    FRONT, READING, SERIAL, TICK, NUM_IDS, GROWN = range(6)
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        # Only living agents are copied, and each of them is on its own tile.
+        # (The agent pool can hold more ids than that, as agents that died
+        # during a tick keep theirs until the end of it.)
+        self.capacity = width * height
+
+        self.lock = multiprocessing.Lock()
+        self.header = self.createArray(numpy.int64, 3 + 3*2)
+        self.header[SnapshotBuffer.FRONT] = -1
+        self.header[SnapshotBuffer.READING] = -1
+
+        self.slots = []
+        for i in range(2):
+            tiles = dict((name, self.createArray(dtype, width * height).reshape(width, height))
+                for name, dtype in SnapshotBuffer.TILE_LAYERS)
+            agents = dict((name, self.createArray(dtype, self.capacity))
+                for name, dtype in SnapshotBuffer.AGENT_COLUMNS)
+            self.slots.append((tiles, agents))
+
+
+    def createArray(self, dtype, n):
+        dtype = numpy.dtype(dtype)
+        raw = RawArray(ctypes.c_byte, max(1, n * dtype.itemsize))
+        return numpy.frombuffer(raw, dtype, n)
+
+
+    def slotField(self, field, slot):
+        # per slot header fields follow the shared ones
+        return SnapshotBuffer.TICK + (field - SnapshotBuffer.TICK) * 2 + slot
+
+
+    def publish(self, world):
+        # Copies world's state into the back slot and makes it the front
+        # slot. Returns False if the snapshot had to be dropped. Only living
+        # agents are copied, numbered from 0.
+        h = self.header
+        with self.lock:
+            slot = 1 - h[SnapshotBuffer.FRONT] if h[SnapshotBuffer.FRONT] >= 0 else 0
+            if h[SnapshotBuffer.READING] == slot:
+                return False
+
+        # the reader only ever takes the front slot, so this is safe to do
+        # without the lock
+        tiles, agents = self.slots[slot]
+        g = world.grid
+        for name, dtype in SnapshotBuffer.TILE_LAYERS:
+            tiles[name][:] = getattr(g, name)
+
+        # the living agents are renumbered by their index in ids, in the
+        # agent layer too. Tiles without an agent read the last entry of
+        # index, which is NONE.
+        pool = world.agent_pool
+        ids = pool.getLiveIds()
+        n = len(ids)
+        for name, dtype in SnapshotBuffer.AGENT_COLUMNS:
+            agents[name][:n] = getattr(pool, name)[ids]
+        index = numpy.empty(pool.size + 1, numpy.int32)
+        index[ids] = numpy.arange(n)
+        index[-1] = g.NONE
+        numpy.take(index, g.agent, out=tiles["agent"])
+
+        with self.lock:
+            h[self.slotField(SnapshotBuffer.TICK, slot)] = world.current_tick
+            h[self.slotField(SnapshotBuffer.NUM_IDS, slot)] = n
+            h[self.slotField(SnapshotBuffer.GROWN, slot)] = world.grown_ticks
+            h[SnapshotBuffer.SERIAL] += 1
+            h[SnapshotBuffer.FRONT] = slot
+        return True
+
+
+    def getSerial(self):
+        # changes every time a snapshot is published
+        return int(self.header[SnapshotBuffer.SERIAL])
+
+
+    def read(self, world):
+        # Copies the front slot into world's TileGrid and AgentPool, marking
+        # the tile blocks that changed as dirty. With lazy regrowth the tiles
+        # are stale and world has to regrow the ones it uses. Returns the tick
+        # of the snapshot, or None if nothing has been published yet.
+        h = self.header
+        with self.lock:
+            slot = h[SnapshotBuffer.FRONT]
+            if slot < 0:
+                return None
+            h[SnapshotBuffer.READING] = slot
+            tick = int(h[self.slotField(SnapshotBuffer.TICK, slot)])
+            n = int(h[self.slotField(SnapshotBuffer.NUM_IDS, slot)])
+            grown_ticks = int(h[self.slotField(SnapshotBuffer.GROWN, slot)])
+
+        try:
+            tiles, agents = self.slots[slot]
+            g = world.grid
+            for name, dtype in SnapshotBuffer.TILE_LAYERS:
+                layer = getattr(g, name)
+                changed = (layer != tiles[name])
+                if name in g.DIRTY_LAYERS:
+                    g.markDirtyTiles(g.getDirty(name), changed)
+                layer[changed] = tiles[name][changed]
+            if world.lazy_regrowth:
+                world.setGrownTicks(grown_ticks)
+
+            pool = world.agent_pool
+            pool.grow(n)
+            for name, dtype in SnapshotBuffer.AGENT_COLUMNS:
+                getattr(pool, name)[:n] = agents[name][:n]
+            pool.alive[n:] = False
+            pool.size = n
+        finally:
+            with self.lock:
+                h[SnapshotBuffer.READING] = -1
+
+        return tick
+
+
+
+class SimulationProcess():
+    # Runs a headless copy of the world from the given config in another
+    # process, publishing snapshots to buffer at most every interval seconds.
+    def __init__(self, data_file_path, width, height, interval=1.0/60):
+        self.buffer = SnapshotBuffer(width, height)
+        self.stats_queue = multiprocessing.Queue()
+        self.paused = multiprocessing.Value(ctypes.c_bool, False)
+        self.quit = multiprocessing.Value(ctypes.c_bool, False)
+        self.process = multiprocessing.Process(target=runSimulation,
+            args=(data_file_path, self.buffer, self.stats_queue, self.paused, self.quit, interval))
+        self.process.daemon = True
+
+
+    def start(self):
+        self.process.start()
+
+
+    def stop(self):
+        self.quit.value = True
+        # the queue has to be emptied for the process to be able to exit
+        self.getStats()
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+    def setPaused(self, paused):
+        self.paused.value = paused
+
+
+    def getStats(self):
+        # Returns the statistics of the ticks run since the last call, as a
+        # list of Statistics.getLatestData results.
+        rows = []
+        try:
+            while True:
+                rows.append(self.stats_queue.get_nowait())
+        except Empty:
+            pass
+        return rows
+
+
+
+def runSimulation(data_file_path, buffer, stats_queue, paused, quit, interval):
+    # the simulation process
+    from headless import Headless
+    world = Headless()
+    world.init(data_file_path)
+
+    next_publish = 0.0
+    while not quit.value:
+        if paused.value:
+            time.sleep(0.01)
+            continue
+
+        world.tick()
+        world.stats.tick()
+        stats_queue.put(world.stats.getLatestData())
+
+        now = time.time()
+        if now >= next_publish:
+            if buffer.publish(world):
+                next_publish = now + interval
+
+    stats_queue.close()
@@ -2,69 +2,273 @@
 # Deals with gathering statistics from the sugarscape simulation.
 #
 
+import os, ctypes, numpy
+from multiprocessing.sharedctypes import RawArray, RawValue
+from culture import BasicCulture
+
+
+class TimeVariableData(object):
+    # Keeps the last size values added in a circular buffer.
+    #
+    # Every value is written twice, at i and i+size, so the last size values
+    # are always a contiguous slice of the buffer and can be read without
+    # copying.
+    #
+    # If spill_path is given, values are also appended to that file (as raw
+    # values of the given dtype) in chunks of size, so the full history is
+    # kept without holding it in memory.
+    def __init__(self, size, default=0, dtype=numpy.float64, spill_path=None):
+        self.size = size
+        self.buffer = numpy.empty(2*size, dtype)
+        self.buffer.fill(default)
+        # index of the oldest value
+        self.head = 0
+        # number of values added so far, and how many of them are on disk
+        self.count = 0
+        self.spilled = 0
+
+        self.spill_path = spill_path
+        self.spill_file = None
+        if spill_path is not None:
+            self.spill_file = open(spill_path, "wb")
 
-class TimeVariableData():
-    def __init__(self, size, default=0):
-        self.data = [default for i in range(size)]
 
     def add(self, datum):
-        self.data.append(datum)
-        self.data = self.data[1:len(self.data)]
+        i = self.head
+        self.buffer[i] = datum
+        self.buffer[i+self.size] = datum
+        self.head = (i + 1) % self.size
+        self.count += 1
+
+        if self.spill_file is not None and self.count - self.spilled == self.size:
+            self.spill()
+
+
+    @property
+    def data(self):
+        # the last size values, oldest first, as a read-only view
+        d = self.buffer[self.head:self.head+self.size]
+        d.flags.writeable = False
+        return d
+
+
+    def latest(self):
+        return self.buffer.item(self.head + self.size - 1)
+
+
+    def share(self):
+        # moves the buffer into shared memory, see Statistics.share
+        raw = RawArray(ctypes.c_byte, self.buffer.nbytes)
+        buffer = numpy.frombuffer(raw, self.buffer.dtype, len(self.buffer))
+        buffer[:] = self.buffer
+        self.buffer = buffer
+
+
+    def spill(self):
+        # write the values not yet on disk to the spill file
+        n = self.count - self.spilled
+        if n:
+            self.data[self.size-n:].tofile(self.spill_file)
+            self.spill_file.flush()
+            self.spilled = self.count
+
+
+    def getHistory(self):
+        # Returns every value added so far if spilling, otherwise the values
+        # that are still in the buffer.
+        n = min(self.count - self.spilled, self.size)
+        recent = self.data[self.size-n:]
+        if self.spill_file is None:
+            return recent.copy()
+
+        old = numpy.fromfile(self.spill_path, self.buffer.dtype, self.spilled)
+        return numpy.concatenate((old, recent))
+
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill()
+            self.spill_file.close()
+            self.spill_file = None
 
 
 
 class Statistics():
-    def __init__(self, sugarscape):
+    # If spill_dir is given, the full history of each statistic is written to
+    # <spill_dir>/<name>.bin as it is gathered.
+    def __init__(self, sugarscape, spill_dir=None):
         self.sim = sugarscape
+        self.spill_dir = spill_dir
         
         self.current_tick = 0
         # the number of ticks in the past to record time variable data for
         self.record_ticks = 100
 
-        self.num_agents_data = TimeVariableData(self.record_ticks, 0)
-        self.agent_age_data  = TimeVariableData(self.record_ticks, 0)
-        self.num_fertile_data = TimeVariableData(self.record_ticks, 0)
-        self.num_births_data = TimeVariableData(self.record_ticks, 0)
-        self.num_deaths_data = TimeVariableData(self.record_ticks, 0)
-        self.mean_vision_data = TimeVariableData(self.record_ticks, 0)
-        self.mean_sugar_metabolism_data = TimeVariableData(self.record_ticks, 0)
-        self.mean_mates = TimeVariableData(self.record_ticks, 0)
-        self.mean_children = TimeVariableData(self.record_ticks, 0)
+        self.num_agents_data = self.createData("num_agents", numpy.int64)
+        # agent_age isn't gathered yet, so it is never written out
+        self.agent_age_data  = self.createData("agent_age", numpy.float64, spill=False)
+        self.num_fertile_data = self.createData("num_fertile", numpy.int64)
+        self.num_births_data = self.createData("num_births", numpy.int64)
+        self.num_deaths_data = self.createData("num_deaths", numpy.int64)
+        self.mean_vision_data = self.createData("mean_vision", numpy.float64)
+        self.mean_sugar_metabolism_data = self.createData("mean_sugar_metabolism", numpy.float64)
+        self.mean_mates = self.createData("mean_mates", numpy.float64)
+        self.mean_children = self.createData("mean_children", numpy.float64)
+
+        # Population totals are kept up to date by the simulation calling
+        # agentBorn, agentDied and agentsMated. Every check_ticks ticks they
+        # are compared against a full scan of the population (0 = never).
+        self.check_ticks = self.sim.data_file.get("stats_check_ticks", 0)
+        self.recompute()
+
+        # current_tick in shared memory once share() has been called
+        self.shared_tick = None
 
 
     def tick(self):
+        if self.check_ticks and self.current_tick % self.check_ticks == 0:
+            self.checkTotals()
+
         self.num_agents_data.add(self.sim.getNumAgents())
         self.num_deaths_data.add(self.sim.num_deaths)
         self.num_births_data.add(self.sim.num_births)
 
         num_agents = max(1, len(self.sim.agents))
-        num_fertile = 0
+
+        # fertility depends on the agents' reserves, which change every tick,
+        # so it is counted over the agent pool's columns instead.
+        self.num_fertile_data.add(self.sim.agent_pool.countFertile())
+        self.mean_vision_data.add(self.total_vision / num_agents)
+        self.mean_sugar_metabolism_data.add(self.total_sugar_metabolism / num_agents)
+        self.mean_mates.add(self.total_mates / num_agents)
+        self.mean_children.add(self.total_children / num_agents)
+
+        self.current_tick += 1
+        if self.shared_tick is not None:
+            self.shared_tick.value = self.current_tick
+
+
+    def createData(self, name, dtype, spill=True):
+        spill_path = None
+        if spill and self.spill_dir is not None:
+            spill_path = os.path.join(self.spill_dir, name + ".bin")
+        return TimeVariableData(self.record_ticks, 0, dtype, spill_path)
+
+
+    def close(self):
+        for d in self.getAllData():
+            d.close()
+
+
+    def share(self):
+        # Moves the time series into shared memory so that processes forked
+        # afterwards can read them with a StatisticsReader while this one
+        # keeps adding to them. Nothing is copied or sent per tick.
+        for name, d in self.getNamedData():
+            d.share()
+        self.shared_tick = RawValue(ctypes.c_int64, self.current_tick)
+
+
+    def getAllData(self):
+        return [self.num_agents_data, self.agent_age_data, self.num_fertile_data,
+            self.num_births_data, self.num_deaths_data, self.mean_vision_data,
+            self.mean_sugar_metabolism_data, self.mean_mates, self.mean_children]
+
+
+    def agentBorn(self, a):
+        self.total_vision += a.vision
+        self.total_sugar_metabolism += a.sugar_metabolism
+        self.total_mates += len(a.mates)
+        self.total_children += len(a.children)
+
+
+    def agentDied(self, a):
+        self.total_vision -= a.vision
+        self.total_sugar_metabolism -= a.sugar_metabolism
+        self.total_mates -= len(a.mates)
+        self.total_children -= len(a.children)
+
+
+    def agentsMated(self, mother, father):
+        # each parent gained a mate and a child
+        self.total_mates += 2
+        self.total_children += 2
+
+
+    def scanTotals(self):
         total_vision = 0.0
         total_sugar_metabolism = 0.0
         total_mates = 0.0
         total_children = 0.0
 
         for a in self.sim.agents:
-            if a.isFertile():
-                num_fertile += 1
+            if a.dead:
+                continue
             total_vision += a.vision
             total_sugar_metabolism += a.sugar_metabolism
             total_mates += len(a.mates)
             total_children += len(a.children)
 
-        self.num_fertile_data.add(num_fertile)
-        self.mean_vision_data.add(total_vision / num_agents)
-        self.mean_sugar_metabolism_data.add(total_sugar_metabolism / num_agents)
-        self.mean_mates.add(total_mates / num_agents)
-        self.mean_children.add(total_children / num_agents)
+        return total_vision, total_sugar_metabolism, total_mates, total_children
 
-        self.current_tick += 1
+
+    def recompute(self):
+        totals = self.scanTotals()
+        self.total_vision, self.total_sugar_metabolism, self.total_mates, self.total_children = totals
+
+
+    def checkTotals(self):
+        # Returns True if the running totals match a full scan. If they don't
+        # they are replaced by the scanned values.
+        current = (self.total_vision, self.total_sugar_metabolism, self.total_mates, self.total_children)
+        scanned = self.scanTotals()
+        if all(abs(a - b) <= 1e-6 * max(1.0, abs(b)) for a, b in zip(current, scanned)):
+            return True
+
+        print "statistics totals {0} differ from population scan {1}".format(current, scanned)
+        self.recompute()
+        return False
 
 
     def getTimePeriod(self):
         return self.current_tick-self.record_ticks, self.current_tick
 
 
+    def getNamedData(self):
+        # (name, TimeVariableData) pairs of the statistics written out by
+        # getLatestData
+        return [
+            ("num_agents", self.num_agents_data),
+            ("num_fertile", self.num_fertile_data),
+            ("num_births", self.num_births_data),
+            ("num_deaths", self.num_deaths_data),
+            ("mean_vision", self.mean_vision_data),
+            ("mean_sugar_metabolism", self.mean_sugar_metabolism_data),
+            ("mean_mates", self.mean_mates),
+            ("mean_children", self.mean_children),
+        ]
+
+
+    def getLatestData(self):
+        # returns (name, value) pairs for the most recently gathered tick
+        return [(name, d.latest()) for name, d in self.getNamedData()]
+
+
+    def addLatestData(self, data):
+        # Adds a tick of (name, value) pairs as returned by getLatestData,
+        # e.g. gathered by a simulation running in another process.
+        for (name, d), (data_name, v) in zip(self.getNamedData(), data):
+            d.add(v)
+        self.current_tick += 1
+        if self.shared_tick is not None:
+            self.shared_tick.value = self.current_tick
+
+
+    def getData(self, name):
+        # the time series of the named statistic, see getNamedData
+        return dict(self.getNamedData())[name].data
+
+
     def getNumAgentsData(self):
         return self.num_agents_data.data
 
@@ -92,3 +296,55 @@ class Statistics():
     def getMeanChildrenData(self):
         return self.mean_children.data
 
+
+    def getCultureGroupHistogram(self):
+        # (group, number of agents) for each BasicCulture group right now
+        counts = BasicCulture.getGroupHistogram(self.sim.agent_pool)
+        return zip(BasicCulture.GROUPS, counts)
+
+
+
+class StatisticsReader():
+    # Reads the time series of a shared Statistics (see Statistics.share)
+    # from another process. update() takes a copy of the latest values, which
+    # are then available through the same getData and getTimePeriod as
+    # Statistics.
+    #
+    # While the current tick is t the writer only touches index t % size (and
+    # t % size + size) of each buffer, publishing t+1 once it's done, so the
+    # size-1 values after that index can't change. The oldest value is left
+    # out and the copy is retried if the tick moved on meanwhile.
+    def __init__(self, stats):
+        self.size = stats.record_ticks
+        self.shared_tick = stats.shared_tick
+        self.buffers = [(name, d.buffer) for name, d in stats.getNamedData()]
+
+        self.current_tick = 0
+        self.data = dict((name, numpy.zeros(self.size-1, b.dtype)) for name, b in self.buffers)
+
+
+    def update(self):
+        # returns True if there were new values
+        t = self.shared_tick.value
+        if t == self.current_tick:
+            return False
+
+        while True:
+            i = t % self.size + 1
+            data = dict((name, b[i:i+self.size-1].copy()) for name, b in self.buffers)
+            now = self.shared_tick.value
+            if now == t:
+                break
+            t = now
+
+        self.current_tick = t
+        self.data = data
+        return True
+
+
+    def getTimePeriod(self):
+        return self.current_tick-self.size+1, self.current_tick
+
+
+    def getData(self, name):
+        return self.data[name]
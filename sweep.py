@@ -0,0 +1,174 @@
+#
+# Runs many headless simulations with different config values in parallel.
+#
+# A sweep file lists config values to use in place of those in the base
+# config. grid gives a list of values for each key and every combination of
+# them is run, runs gives a list of sets of values, each of which is run with
+# every grid combination. e.g.
+#
+#   grid:
+#     vision_range: [[1, 6], [6, 10]]
+#     random_seed: [1, 2, 3]
+#   runs:
+#     - {pollution_decay: 0.1}
+#     - {pollution_decay: 0.3}
+#
+# Runs are handed out one at a time to a pool of worker processes, so a
+# worker that finishes early just takes the next run. Each run's statistics
+# are added to an sqlite database as soon as it finishes, and runs that
+# finished successfully are skipped, so an interrupted sweep can be carried on
+# (and its failed runs retried) by running it again. The database's runs must
+# have been made with the same sweep and number of ticks, as runs are only
+# identified by their index.
+#
+# With a cache directory, runs are also looked up in and added to a RunCache,
+# so runs already made by an earlier sweep aren't simulated again.
+#
+
+import argparse, itertools, json, multiprocessing, sqlite3, sys, time, yaml
+from headless import Headless
+from run_cache import RunCache
+
+
+def expandSweep(sweep):
+    # Returns the config overrides of every run in the sweep, in a fixed
+    # order so a run's index identifies it.
+    grid = sweep.get("grid", {})
+    keys = sorted(grid)
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+    runs = []
+    for extra in sweep.get("runs", [{}]):
+        for combination in combinations:
+            overrides = dict(combination)
+            overrides.update(extra)
+            runs.append(overrides)
+    return runs
+
+
+def runOne(args):
+    # the worker processes' job. Returns (run index, elapsed seconds, names,
+    # rows, error), see Headless.runStats.
+    index, data_file_path, overrides, num_ticks, cache_dir, cache_bytes = args
+    start_time = time.time()
+    try:
+        h = Headless()
+        h.data_overrides = overrides
+        if cache_dir is not None:
+            names, rows = RunCache(cache_dir, cache_bytes).runStats(h, data_file_path, num_ticks)
+        else:
+            names, rows = h.runStats(data_file_path, num_ticks)
+        error = None
+    except Exception as e:
+        names, rows = [], []
+        error = "{0}: {1}".format(type(e).__name__, e)
+    return index, time.time() - start_time, names, rows, error
+
+
+
+class SweepResults():
+    # The sqlite database runs and their statistics are written to. Each run
+    # has a row in runs, with a status of "done" or "failed", and a row in
+    # stats for every tick with a column per statistic.
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS runs (
+            run INTEGER PRIMARY KEY, overrides TEXT, ticks INTEGER,
+            elapsed REAL, error TEXT, status TEXT)""")
+        if "status" not in [r[1] for r in self.db.execute("PRAGMA table_info(runs)")]:
+            # written before runs had a status
+            self.db.execute("ALTER TABLE runs ADD COLUMN status TEXT")
+            self.db.execute("UPDATE runs SET status = CASE WHEN error IS NULL THEN 'done' ELSE 'failed' END")
+        self.db.commit()
+        self.insert_stats = None
+
+
+    def getDoneRuns(self, runs, num_ticks):
+        # The indices of the runs that finished successfully, failed runs are
+        # run again. runs and num_ticks are the sweep's overrides and ticks,
+        # which have to match those stored for every run in the database.
+        done = set()
+        mismatched = []
+        for index, overrides, ticks, status in self.db.execute("SELECT run, overrides, ticks, status FROM runs"):
+            if (index >= len(runs) or ticks != num_ticks
+                    or json.loads(overrides) != json.loads(json.dumps(runs[index], sort_keys=True))):
+                mismatched.append(index)
+            elif status == "done":
+                done.add(index)
+
+        if mismatched:
+            raise ValueError("runs {0} in the results database were made with different config values or "
+                "ticks, use a new database for a different sweep".format(sorted(mismatched)))
+        return done
+
+
+    def hasStats(self):
+        return self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats'").fetchone() is not None
+
+
+    def add(self, index, overrides, num_ticks, elapsed, names, rows, error):
+        if rows and self.insert_stats is None:
+            columns = ", ".join("{0} REAL".format(name) for name in names)
+            self.db.execute("CREATE TABLE IF NOT EXISTS stats (run INTEGER, tick INTEGER, {0})".format(columns))
+            self.db.execute("CREATE INDEX IF NOT EXISTS stats_run ON stats (run, tick)")
+            self.insert_stats = "INSERT INTO stats VALUES ({0})".format(", ".join(["?"] * (len(names) + 2)))
+
+        # a retried run replaces the row (and any stats) of its failed attempt
+        status = "done" if error is None else "failed"
+        self.db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+            (index, json.dumps(overrides, sort_keys=True), num_ticks, elapsed, error, status))
+        if self.hasStats():
+            self.db.execute("DELETE FROM stats WHERE run = ?", (index,))
+        if rows:
+            self.db.executemany(self.insert_stats, ([index] + row for row in rows))
+        self.db.commit()
+
+
+    def close(self):
+        self.db.close()
+
+
+
+def runSweep(data_file_path, sweep, num_ticks, results_path, processes=None, cache_dir=None, cache_bytes=1 << 30):
+    runs = expandSweep(sweep)
+    results = SweepResults(results_path)
+    try:
+        done = results.getDoneRuns(runs, num_ticks)
+    except ValueError:
+        results.close()
+        raise
+    todo = [(i, data_file_path, overrides, num_ticks, cache_dir, cache_bytes)
+        for i, overrides in enumerate(runs) if i not in done]
+    print "{0} runs, {1} already done".format(len(runs), len(runs) - len(todo))
+
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for n, (index, elapsed, names, rows, error) in enumerate(pool.imap_unordered(runOne, todo), 1):
+            results.add(index, runs[index], num_ticks, elapsed, names, rows, error)
+            if error is not None:
+                print "run {0} {1} failed: {2}".format(index, runs[index], error)
+            print "{0}/{1} runs done ({2:.1f}s)".format(n, len(todo), time.time() - start_time)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        results.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the sugarscape simulation over many config values in parallel.")
+    parser.add_argument("config", help="base simulation config file, e.g. sugarscape.yaml")
+    parser.add_argument("sweep", help="sweep file giving the config values to run with")
+    parser.add_argument("ticks", type=int, help="number of ticks to run each simulation for")
+    parser.add_argument("results", help="sqlite database the results are added to")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--cache", default=None, help="directory of cached runs to reuse and add to")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size the cache is kept under, in MB (default: 1024)")
+    args = parser.parse_args()
+
+    sweep = yaml.load(file(args.sweep, 'r'))
+    try:
+        runSweep(args.config, sweep, args.ticks, args.results, args.processes, args.cache, args.cache_size << 20)
+    except ValueError as e:
+        sys.exit(str(e))
@@ -7,3 +7,17 @@ def clamped(min_v, max_v, v):
     if v > max_v:
         return max_v
     return v
+
+def packBits(bits):
+    # packs a list of 0s and 1s into an int, with bit i being bits[i]
+    v = 0
+    for i, b in enumerate(bits):
+        if b:
+            v |= 1 << i
+    return v
+
+def unpackBits(v, length):
+    return [(v >> i) & 1 for i in range(length)]
+
+def popcount(v):
+    return bin(v).count("1")
@@ -0,0 +1,717 @@
+import sys, yaml, util, numpy
+
+from random import Random
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+from agent import Agent
+from disease import Disease
+from statistics import Statistics
+from grid import TileGrid
+from movement import BatchMovement
+from agent_pool import AgentPool
+from schedule import SeasonSchedule, SeasonCalendar
+
+
+#---------------------------------------------------------------------------#
+#                                                                           #
+#                          Sugarscape World                                 #
+#                                                                           #
+#---------------------------------------------------------------------------#
+class World():
+
+#---------------------------------------------------------------------------#
+#                                Tile Data                                  #
+#---------------------------------------------------------------------------#
+    class Tile(object):
+        # A view of a single tile's data. The data itself lives in the world's
+        # TileGrid, so views are cheap to create and never go stale.
+        __slots__ = ["world", "x", "y"]
+
+        def __init__(self, world, x, y):
+            self.world = world
+            self.x, self.y = world.grid.wrap(x, y)
+
+        def _get(name):
+            return lambda self: getattr(self.world.grid, name).item(self.x, self.y)
+
+        def _getResource(name):
+            # sugar and spice may be out of date with lazy regrowth
+            def getter(self):
+                if self.world.lazy_regrowth:
+                    self.world.regrowTile(self.x, self.y)
+                return getattr(self.world.grid, name).item(self.x, self.y)
+            return getter
+
+        def _set(name):
+            def setter(self, v):
+                getattr(self.world.grid, name)[self.x, self.y] = v
+                if name in TileGrid.DIRTY_LAYERS:
+                    self.world.grid.markDirty(name, self.x, self.y)
+            return setter
+
+        sugar     = property(_getResource("sugar"), _set("sugar"))
+        spice     = property(_getResource("spice"), _set("spice"))
+        max_sugar = property(_get("max_sugar"), _set("max_sugar"))
+        max_spice = property(_get("max_spice"), _set("max_spice"))
+        pollution = property(_get("pollution"),
+            lambda self, v: self.world.grid.setPollution(self.x, self.y, v))
+        del _get, _getResource, _set
+
+        @property
+        def agent(self):
+            return self.world.getAgentAt(self.x, self.y)
+
+        @property
+        def region(self):
+            r = self.world.grid.region.item(self.x, self.y)
+            if r == TileGrid.NONE:
+                return None
+            return self.world.region_list[r]
+
+
+    class Season():
+        # Seasons is an array of dictionaries where each dictionary where each
+        # dictionary defines a season. A season defines growth rates for a 
+        # number of ticks. Each dictionary should contain:
+        # ["ticks"] the number of ticks for the rates to be active
+        # ["sugar_growth"] the sugar growth
+        # ["spice_growth"] the spice growth
+        #
+        # When a season has been active for its defined number of ticks, the
+        # current season is set to the next season in the array, wrapping back
+        # to the start if necessary.
+        def __init__(self, ticks, sugar_growth, spice_growth):
+            self.ticks = ticks
+            self.sugar_growth = sugar_growth
+            self.spice_growth = spice_growth
+
+
+    class Region():
+        # x1, y1, x2, y2 specify a rectangular region of tiles that make up the
+        # region.
+        #
+        # Tiles are inclusive.
+        # x1 < x2 and y1 < y2
+        #
+        # seasons is an array of Seasons. Initially the current_season is set to
+        # the first Season in the array.
+        # When a season has been active for its defined number of ticks, the
+        # current season is set to the next season in the array, wrapping back
+        # to the start if necessary. The world's SeasonCalendar decides when
+        # that happens, using the region's schedule.
+        def __init__(self, seasons):
+            #self.x1, self.y1 = x1, y1
+            #self.x2, self.y2 = x2, y2
+
+            if seasons:
+                self.seasons = seasons
+            else:
+                self.seasons = [World.Season(1000, 1, 1)]
+
+            self.current_index = 0
+            self.current_season = self.seasons[0]
+
+            # the same seasons compiled into a table of start ticks
+            self.schedule = SeasonSchedule(self.seasons)
+
+
+        def setSeason(self, index):
+            self.current_index = index
+            self.current_season = self.seasons[index]
+
+
+
+
+
+#---------------------------------------------------------------------------#
+#                                                                           #
+#                            initialization/shutdown                        #
+#                                                                           #
+#---------------------------------------------------------------------------#
+    def __init__(self):
+        self.verbose = True
+        # directory to write the full history of the statistics to, if any
+        self.stats_spill_dir = None
+        # config values to use in place of those in the data file, if any
+        self.data_overrides = None
+
+
+    def init(self, data_file_path="sugarscape.yaml"):
+        self.data_file_path = data_file_path
+        self.rand = Random()
+
+        # tilemap
+        self.loadData(data_file_path)
+        data = self.data_file
+
+        # agent properties
+        self.num_agents             = data["num_agents"]
+        self.vision_range           = data["vision_range"]
+        self.sugar_metabolism_range = data["sugar_metabolism_range"]
+        self.spice_metabolism_range = data["spice_metabolism_range"]
+        self.initial_sugar_range    = data["initial_sugar_range"]
+        self.initial_spice_range    = data["initial_spice_range"]
+        self.max_age_range          = data["max_age_range"]
+        self.m_fertile_start_range  = data["m_fertile_start_range"]
+        self.m_fertile_end_range    = data["m_fertile_end_range"]
+        self.f_fertile_start_range  = data["f_fertile_start_range"]
+        self.f_fertile_end_range    = data["f_fertile_end_range"]
+        self.num_culture_tags       = data["num_culture_tags"]
+
+        # agent mutations
+        self.vision_mutation_chance           = data["vision_mutation_chance"]
+        self.global_vision_range              = data["global_vision_range"]
+        self.vision_mutation_range            = data["vision_mutation_range"]
+
+        self.sugar_metabolism_mutation_chance = data["sugar_metabolism_mutation_chance"]
+        self.global_sugar_metabolism_range    = data["global_sugar_metabolism_range"]
+        self.sugar_metabolism_mutation_range  = data["sugar_metabolism_mutation_range"]
+
+        self.spice_metabolism_mutation_chance = data["spice_metabolism_mutation_chance"]
+        self.global_spice_metabolism_range    = data["global_spice_metabolism_range"]
+        self.spice_metabolism_mutation_range  = data["spice_metabolism_mutation_range"]
+
+        self.age_mutation_chance              = data["age_mutation_chance"]
+        self.global_age_range                 = data["global_age_range"]
+        self.age_mutation_range               = data["age_mutation_range"]
+
+        # pollution properties
+        self.pollution_ticks            = data["pollution_ticks"]
+        self.pollution_sugar_metabolism = data["pollution_sugar_metabolism"]
+        self.pollution_spice_metabolism = data["pollution_spice_metabolism"]
+        self.pollution_harvest          = data["pollution_harvest"]
+        self.pollution_decay            = data["pollution_decay"]
+
+        # movement
+        self.batch_movement = data.get("batch_movement", False)
+        self.movement = BatchMovement(self)
+
+        # resource regrowth. With lazy regrowth tiles are only brought up to
+        # date when they are read, which needs growth rates of 0 or more.
+        # Runs only match growing every tick exactly with whole number rates.
+        self.lazy_regrowth = data.get("lazy_regrowth", False)
+        if self.lazy_regrowth and not all(r.schedule.isMonotonic() for r in self.region_list):
+            print "lazy regrowth needs growth rates >= 0, growing every tick instead"
+            self.lazy_regrowth = False
+        if self.lazy_regrowth and not all(r.schedule.hasIntegerRates() for r in self.region_list):
+            print "lazy regrowth with fractional growth rates gives slightly different results to growing every tick"
+
+        # ticks of growth every tile has had, and each region's total growth
+        # over those ticks (with a last entry of 0 for tiles without a region)
+        self.grown_ticks = 0
+        self.region_sugar_total = numpy.zeros(len(self.region_list)+1, numpy.float64)
+        self.region_spice_total = numpy.zeros(len(self.region_list)+1, numpy.float64)
+
+        # diseases
+        self.diseases = []
+        self.num_initial_diseases        = data["num_initial_diseases"]
+        self.disease_string_length_range = data["disease_string_length_range"]
+        self.disease_extra_sugar_range   = data["disease_extra_sugar_range"]
+        self.disease_extra_spice_range   = data["disease_extra_spice_range"]
+
+        self.disease_infliction_ticks     = data["disease_infliction_ticks"]
+        self.disease_infliction_agents    = data["disease_infliction_agents"]
+        self.next_disease_infliction_tick = self.disease_infliction_ticks
+
+        # immune systems are bit strings of this length. "legacy" matching
+        # reproduces the original matcher, which compared a disease against
+        # the first bit of each immune system window only.
+        self.immune_sys_length = 50
+        self.legacy_immune_matching = data.get("immune_matching", "legacy") == "legacy"
+
+        # An agent can't catch a disease with the same string as one it
+        # already has, and is immune to both or neither, so diseases with
+        # equal strings share an id. Their extra metabolisms may differ.
+        disease_ids = {}
+        for i in range(self.num_initial_diseases):
+            d = Disease(self.rand,
+                self.rand.randint(self.disease_string_length_range[0], self.disease_string_length_range[1]),
+                self.rand.randint(self.disease_extra_sugar_range[0], self.disease_extra_sugar_range[1]),
+                self.rand.randint(self.disease_extra_spice_range[0], self.disease_extra_spice_range[1]))
+            d.id = disease_ids.setdefault((d.length, d.string), len(disease_ids))
+            self.diseases.append(d)
+
+        # simulation variables
+        self.current_tick = 0
+        self.next_pollution_tick = self.pollution_ticks - 1
+        self.num_births = 0
+        self.num_deaths = 0
+        self.death_causes = {}
+
+        # agents
+        self.agents = []
+        self.agent_pool = AgentPool()
+
+        # statistics keep running totals over the population, so they must
+        # exist before any agents are spawned.
+        self.stats = Statistics(self, self.stats_spill_dir)
+
+        for i in range(min(self.tiles_x * self.tiles_y, self.num_agents)):
+            args = {
+                "sugar_metabolism"  : self.rand.randint(self.sugar_metabolism_range[0], self.sugar_metabolism_range[1]),
+                "spice_metabolism"  : self.rand.randint(self.spice_metabolism_range[0], self.spice_metabolism_range[1]),
+                "vision"            : self.rand.randint(self.vision_range[0], self.vision_range[1]),
+                "sugar"             : self.rand.randint(self.initial_sugar_range[0], self.initial_sugar_range[1]),
+                "spice"             : self.rand.randint(self.initial_spice_range[0], self.initial_spice_range[1]),
+                "max_age"           : self.rand.randint(self.max_age_range[0], self.max_age_range[1]),
+                "gender"            : self.rand.choice(("male", "female")),
+            }
+
+            if args["gender"] == "male":
+                fertile_start_range = self.m_fertile_start_range
+                fertile_end_range   = self.m_fertile_end_range
+            else:
+                fertile_start_range = self.f_fertile_start_range
+                fertile_end_range   = self.f_fertile_end_range
+
+            args["fertile_age_start"] = self.rand.randint(fertile_start_range[0], fertile_start_range[1])
+            args["fertile_age_end"] = self.rand.randint(fertile_end_range[0], fertile_end_range[1])
+
+            args["culture_tags"] = util.packBits([self.rand.choice((0, 1)) for _ in range(0, self.num_culture_tags)])
+            args["num_culture_tags"] = self.num_culture_tags
+            args["culture"] = "BasicCulture"
+
+            self.rand.shuffle(self.diseases)
+            args["diseases"] = self.diseases[:data["num_agent_diseases"]]
+            args["immune_sys"] = util.packBits([self.rand.choice((0, 1)) for _ in range(0, self.immune_sys_length)])
+
+            # find an unoccupied tile
+            location_taken = True
+            while location_taken:
+                x = self.rand.randint(0, self.tiles_x-1)
+                y = self.rand.randint(0, self.tiles_y-1)
+                location_taken = self.isTileOccupied(x, y)
+
+            args["x"], args["y"] = x, y
+
+            self.spawnAgent(args)
+
+        # Gather stats for the initial simulation state (tick 0).
+        # Do this here since the simulation is ticked, then stats are gathered
+        # for it and displayed.
+        self.stats.tick()
+
+
+#---------------------------------------------------------------------------#
+#                                                                           #
+#                                   ticking                                 #
+#                                                                           #
+#---------------------------------------------------------------------------#
+    def tick(self):
+        self.num_births = 0
+        self.num_deaths = 0
+        self.death_causes.clear()
+
+        for i in self.calendar.advance(self.current_tick):
+            self.region_list[i].setSeason(self.calendar.season_index[i])
+
+        if self.lazy_regrowth:
+            self.advanceRegrowth()
+        else:
+            self.growResourcesRegional()
+
+        if self.next_pollution_tick <= self.current_tick:
+            self.pollutionDecayDiffusion()
+            self.next_pollution_tick = self.current_tick + self.pollution_ticks
+
+        if self.current_tick >= self.next_disease_infliction_tick:
+            self.inflictDiseaseOnAgents()
+
+        if self.batch_movement:
+            self.tickAgentsBatched()
+        else:
+            for a in self.agents:
+                a.tick()
+
+                if a.dead:
+                    self.removeDeadAgent(a)
+
+        for a in self.agents:
+            if a.dead:
+                self.agent_pool.release(a)
+
+        self.agents = [a for a in self.agents if not a.dead]
+        self.rand.shuffle(self.agents)
+
+        self.current_tick += 1
+
+        #print "births={0} deaths={1}".format(self.num_births, self.num_deaths)
+        if self.death_causes and self.verbose:
+            print self.death_causes
+
+
+    def tickAgentsBatched(self):
+        # The moves of all agents are planned together, then each agent
+        # metabolises and acts at its turn as it does when ticked on its own.
+        n = len(self.agents)
+        movers = self.agents[:n]
+        self.movement.plan(movers)
+        for i, a in enumerate(movers):
+            if a.metabolise():
+                a.act(self.movement.resolve(i))
+            else:
+                self.removeDeadAgent(a)
+
+        # children born this tick get to act too, as they do when agents
+        # tick one at a time.
+        while n < len(self.agents):
+            a = self.agents[n]
+            a.tick()
+            if a.dead:
+                self.removeDeadAgent(a)
+            n += 1
+
+
+    def removeDeadAgent(self, a):
+        self.setAgentAt(None, a.x, a.y)
+        self.stats.agentDied(a)
+        self.num_deaths += 1
+        self.death_causes.setdefault(a.death_cause, 0)
+        self.death_causes[a.death_cause] += 1
+
+        
+#---------------------------------------------------------------------------#
+#                                                                           #
+#                           Tilemap functions                               #
+#                                                                           #
+#---------------------------------------------------------------------------#
+    def loadData(self, data_file_path):
+        # data_file_path may also be an already loaded config, e.g. the one
+        # stored in a checkpoint
+        if isinstance(data_file_path, dict):
+            self.data_file = dict(data_file_path)
+        else:
+            self.data_file = yaml.load(file(data_file_path, 'r'))
+        if self.data_overrides:
+            self.data_file.update(self.data_overrides)
+
+        if "random_seed" in self.data_file:
+            seed = self.data_file["random_seed"]
+        else:
+            seed = self.rand.randint(0, sys.maxint)
+
+        print "seeding RNG with {0}".format(seed)
+        self.seed = seed
+        self.rand.seed(seed)
+
+        sugar_img = self.loadImage(self.data_file["sugar_file"])
+        spice_img = self.loadImage(self.data_file["spice_file"])
+        region_img = self.loadImage(self.data_file["regions_file"])
+
+        self.tiles_x = len(sugar_img)
+        self.tiles_y = len(spice_img[0])
+
+        self.grid = TileGrid(self.tiles_x, self.tiles_y)
+        self.grid.setResources(sugar_img, spice_img)
+        self.max_sugar_level = float(max(1.0, self.grid.max_sugar.max()))
+        self.max_spice_level = float(max(1.0, self.grid.max_spice.max()))
+
+        #s1 = World.Season(50, 1.0, 1.0)
+        #s2 = World.Season(50, 1.0, 1.0)
+        #r1 = World.Region(0,0,self.tiles_x-1,(self.tiles_y-1)/2, [s1, s2])
+        #r2 = World.Region(0,(self.tiles_y-1)/2,self.tiles_x-1,self.tiles_y-1, [s2, s1])
+        #self.regions = []
+        #self.regions.append(r1)
+        #self.regions.append(r2)
+
+        #for r in self.regions:
+        #    for x in range(r.x1, r.x2+1):
+        #        for y in range(r.y1, r.y2+1):
+        #            self.tiles[x][y].region = r
+
+        seasons = {}
+        for s_data in self.data_file["seasons"]:
+            seasons[s_data["name"]] = World.Season(s_data["ticks"], s_data["sugar_growth"], s_data["spice_growth"])
+
+        # regions are looked up by their region_id, tiles store the index of
+        # their region in region_list.
+        self.regions = {}
+        self.region_list = []
+        for r_data in self.data_file["regions"]:
+            S = []
+            for s_name in r_data["season_names"]:
+                if s_name in seasons:
+                    S.append(seasons[s_name])
+
+            if not S:
+                print "region {0} has no associated seasons!".format(r_data["region_id"])
+
+            r = World.Region(S)
+            self.regions[r_data["region_id"]] = r
+            self.region_list.append(r)
+
+        region_img = numpy.array(region_img)
+        for i, r_data in enumerate(self.data_file["regions"]):
+            self.grid.region[region_img == r_data["region_id"]] = i
+
+        for x, y in numpy.argwhere(self.grid.region == TileGrid.NONE):
+            print "tile[{0}][{1}] has no associated region!".format(x, y)
+
+        # The calendar keeps the growth rates of each region's current season
+        # in lookup tables indexed by region id, which are only changed when
+        # a season changes.
+        self.calendar = SeasonCalendar([r.schedule for r in self.region_list], self.grid.dtype)
+        for i, r in enumerate(self.region_list):
+            r.setSeason(self.calendar.season_index[i])
+
+
+    def loadImage(self, path):
+        # Returns the red channel of an image as a 2D array indexed [x][y],
+        # with y=0 being the bottom row of the image.
+        img = Image.open(path).convert("RGB")
+        w, h = img.size
+        pixels = img.load()
+        return [[pixels[x, h-y-1][0] for y in range(h)] for x in range(w)]
+
+
+    def growResourcesGlobal(self, growth):
+        self.grid.growGlobal(growth)
+
+
+    def growResourcesRegional(self):
+        self.grid.growRegional(self.calendar.sugar_growth, self.calendar.spice_growth)
+
+
+    def advanceRegrowth(self):
+        # Lazy version of growResourcesRegional. Only the regions' growth
+        # totals are updated, tiles catch up when they are read.
+        self.grown_ticks = self.current_tick + 1
+        self.calendar.totalGrowth(self.grown_ticks, self.region_sugar_total, self.region_spice_total)
+
+
+    def setGrownTicks(self, t):
+        # Sets the tick the tiles have to catch up to without ticking, for a
+        # world showing the snapshots of another one (see snapshot.py).
+        self.grown_ticks = t
+        for i, region in enumerate(self.region_list):
+            self.region_sugar_total[i], self.region_spice_total[i] = region.schedule.totalGrowth(t)
+
+
+    def regrowTile(self, x, y):
+        # Brings the sugar and spice of the wrapped tile x,y up to date. As
+        # growth is never negative, clamping once at the end gives the same
+        # result as clamping after every tick.
+        g = self.grid
+        last = g.updated.item(x, y)
+        if last == self.grown_ticks:
+            return
+
+        g.updated[x, y] = self.grown_ticks
+        r = g.region.item(x, y)
+        if r == TileGrid.NONE:
+            return
+
+        sugar, spice = self.region_list[r].schedule.totalGrowth(last)
+        g.sugar[x, y] = min(g.max_sugar.item(x, y), g.sugar.item(x, y) + (self.region_sugar_total.item(r) - sugar))
+        g.spice[x, y] = min(g.max_spice.item(x, y), g.spice.item(x, y) + (self.region_spice_total.item(r) - spice))
+        b = TileGrid.BLOCK_SHIFT
+        g.dirty_sugar[x >> b, y >> b] = True
+        g.dirty_spice[x >> b, y >> b] = True
+
+
+    def regrowTiles(self, x, y):
+        # regrowTile for arrays of wrapped coordinates
+        g = self.grid
+        last = g.updated[x, y]
+        stale = last != self.grown_ticks
+        if not stale.any():
+            return
+
+        x, y, last = x[stale], y[stale], last[stale]
+        r = g.region[x, y]
+        sugar = self.region_sugar_total[r]
+        spice = self.region_spice_total[r]
+        for i, region in enumerate(self.region_list):
+            in_region = (r == i)
+            if in_region.any():
+                s1, s2 = region.schedule.totalGrowthArray(last[in_region])
+                sugar[in_region] -= s1
+                spice[in_region] -= s2
+
+        g.sugar[x, y] = numpy.minimum(g.max_sugar[x, y], g.sugar[x, y] + sugar)
+        g.spice[x, y] = numpy.minimum(g.max_spice[x, y], g.spice[x, y] + spice)
+        g.updated[x, y] = self.grown_ticks
+
+        b = TileGrid.BLOCK_SHIFT
+        g.dirty_sugar[x >> b, y >> b] = True
+        g.dirty_spice[x >> b, y >> b] = True
+
+
+    def regrowRect(self, x1, y1, x2, y2):
+        # brings the tiles x1 to x2, y1 to y2 (exclusive) up to date, e.g.
+        # before drawing them
+        if self.lazy_regrowth:
+            x, y = numpy.nonzero(self.grid.updated[x1:x2, y1:y2] != self.grown_ticks)
+            self.regrowTiles(x + x1, y + y1)
+
+
+    def regrowAll(self):
+        # brings every tile up to date
+        self.regrowRect(0, 0, self.tiles_x, self.tiles_y)
+
+
+    def pollutionDiffusion(self):
+        self.grid.diffusePollution()
+
+
+    def pollutionDecay(self):
+        self.grid.decayPollution(self.pollution_decay)
+
+
+    def pollutionDecayDiffusion(self):
+        self.grid.decayAndDiffusePollution(self.pollution_decay)
+
+
+    def harvestSugarAt(self, x, y):
+        x, y = x % self.tiles_x, y % self.tiles_y
+        if self.lazy_regrowth:
+            self.regrowTile(x, y)
+        s = self.grid.sugar.item(x, y)
+        self.grid.sugar[x, y] = 0
+        self.grid.dirty_sugar[x >> TileGrid.BLOCK_SHIFT, y >> TileGrid.BLOCK_SHIFT] = True
+        self.grid.addPollution(x, y, self.pollution_harvest * s)
+        return s
+
+
+    def harvestSpiceAt(self, x, y):
+        x, y = x % self.tiles_x, y % self.tiles_y
+        if self.lazy_regrowth:
+            self.regrowTile(x, y)
+        s = self.grid.spice.item(x, y)
+        self.grid.spice[x, y] = 0
+        self.grid.dirty_spice[x >> TileGrid.BLOCK_SHIFT, y >> TileGrid.BLOCK_SHIFT] = True
+        self.grid.addPollution(x, y, self.pollution_harvest * s)
+        return s
+
+
+    def getTileAt(self, x, y):
+        return World.Tile(self, x, y)
+
+
+    def getSugarAt(self, x, y):
+        x, y = x % self.tiles_x, y % self.tiles_y
+        if self.lazy_regrowth:
+            self.regrowTile(x, y)
+        return self.grid.sugar.item(x, y)
+
+
+    def getSpiceAt(self, x, y):
+        x, y = x % self.tiles_x, y % self.tiles_y
+        if self.lazy_regrowth:
+            self.regrowTile(x, y)
+        return self.grid.spice.item(x, y)
+
+
+    def getPollutionAt(self, x, y):
+        return self.grid.pollution.item(x % self.tiles_x, y % self.tiles_y)
+
+
+    def addPollution(self, x, y, amount):
+        self.grid.addPollution(x % self.tiles_x, y % self.tiles_y, amount)
+
+
+    def addSugarMetabolismPollution(self, x, y, sugar):
+        self.addPollution(x, y, self.pollution_sugar_metabolism * sugar)
+
+    
+    def addSpiceMetabolismPollution(self, x, y, spice):
+        self.addPollution(x, y, self.pollution_spice_metabolism * spice)
+
+    
+    def spawnAgent(self, args):
+        a = Agent(self, **args)
+        self.agents.append(a)
+        self.setAgentAt(a, a.x, a.y)
+        self.stats.agentBorn(a)
+        self.num_births += 1
+        return a
+
+
+    def agentsMated(self, mother, father, child):
+        mother.children.append(child)
+        father.children.append(child)
+        mother.mates.append(father)
+        father.mates.append(mother)
+        self.stats.agentsMated(mother, father)
+
+
+    def setAgentAt(self, agent, x, y):
+        x, y = x % self.tiles_x, y % self.tiles_y
+        if agent is None:
+            self.grid.setAgent(x, y, TileGrid.NONE)
+        else:
+            self.grid.setAgent(x, y, agent.id)
+        return x, y
+
+
+    def getAgentAt(self, x, y):
+        a = self.grid.agent.item(x % self.tiles_x, y % self.tiles_y)
+        if a == TileGrid.NONE:
+            return None
+        return self.agent_pool.getAgent(a)
+
+
+    def getNeighbourAgents(self, x, y):
+        # The grid keeps a mask of the occupied neighbours of every tile (see
+        # TileGrid.setAgent), so only the occupied tiles are looked at.
+        g = self.grid
+        x, y = x % self.tiles_x, y % self.tiles_y
+        mask = g.neighbours.item(x, y)
+        if not mask:
+            return []
+
+        n_locs = g.getNeighbourCoords(x, y)
+        views = self.agent_pool.views
+        return [views[g.agent.item(n_locs[k])] for k in TileGrid.NEIGHBOUR_BITS[mask]]
+
+        
+    def updateAgentPosition(self, agent, old_x, old_y, new_x, new_y):
+        self.setAgentAt(None, old_x, old_y)
+        return self.setAgentAt(agent, new_x, new_y)
+
+
+    def isTileOccupied(self, x, y):
+        return self.grid.agent.item(x % self.tiles_x, y % self.tiles_y) != TileGrid.NONE
+
+
+    def tileHasEmptyNeighbour(self, x, y):
+        return self.grid.neighbours.item(x % self.tiles_x, y % self.tiles_y) != TileGrid.FULL
+
+
+    def getEmptyNeighbourTiles(self, x, y):
+        mask = self.grid.neighbours.item(x % self.tiles_x, y % self.tiles_y)
+        if mask == TileGrid.FULL:
+            return []
+
+        n_locs = [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]
+        return [n_locs[k] for k in TileGrid.NEIGHBOUR_BITS[TileGrid.FULL ^ mask]]
+
+
+    def getWorldSize(self):
+        return self.tiles_x, self.tiles_y
+
+    
+
+#---------------------------------------------------------------------------#
+#                                                                           #
+#                           Agent functions                                 #
+#                                                                           #
+#---------------------------------------------------------------------------#
+    def getNumAgents(self):
+        return len(self.agents)
+
+
+    def inflictDiseaseOnAgents(self):
+        self.next_disease_infliction_tick = self.current_tick + self.disease_infliction_ticks
+
+        if not self.agents:
+            return
+
+        for i in range(self.disease_infliction_agents):
+            a = self.rand.choice(self.agents)
+            d = self.rand.choice(self.diseases)
+            a.infect(d)
+        
+